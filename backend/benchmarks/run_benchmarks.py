@@ -0,0 +1,437 @@
+"""
+Micro-benchmarks for the conversion service functions.
+
+Each case runs in a forked child process (so the pdf-service and image-service
+`app` packages can both be imported, and memory is measured per case) and
+reports wall time, throughput and peak memory over a parameter grid.
+
+    python benchmarks/run_benchmarks.py                       # full grid
+    python benchmarks/run_benchmarks.py --quick -k split      # subset
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --threshold 0.15
+"""
+import argparse
+import ctypes
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+from types import SimpleNamespace
+
+from synthetic import make_image, make_pdf
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Keep benchmark runs self-contained: local SQLite, no span export
+os.environ.setdefault("MYSQL_URL", f"sqlite:///{tempfile.gettempdir()}/easyconvert-bench-{os.getpid()}.db")
+os.environ.setdefault("TRACE_EXPORTER", "none")
+
+class Case:
+    """
+    One benchmarked function. make_inputs(params) runs in the parent (inputs are
+    shared with the forked child); prepare(inputs) runs in the child, imports the
+    service code and returns (callable, work_units).
+    """
+
+    def __init__(self, name, service, grid, quick_grid, unit, make_inputs, prepare):
+        self.name = name
+        self.service = service
+        self.grid = grid
+        self.quick_grid = quick_grid
+        self.unit = unit
+        self.make_inputs = make_inputs
+        self.prepare = prepare
+
+    def param_sets(self, quick: bool):
+        grid = self.quick_grid if quick else self.grid
+        keys = list(grid)
+        for values in itertools.product(*(grid[k] for k in keys)):
+            yield dict(zip(keys, values))
+
+def _mb(*blobs) -> float:
+    return sum(len(b) for b in blobs) / (1024 * 1024)
+
+# --- pdf-service -----------------------------------------------------------
+
+def _prepare_process_pdf_conversion(inputs):
+    from app.database import Base, SessionLocal, engine
+    from app.models import FileStore, ProcessedImages
+    from app.services.pdf_service import process_pdf_conversion
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+
+    def run():
+        # Reset the job so every repeat renders every page
+        db.query(ProcessedImages).filter(ProcessedImages.parent_file_id == "bench").delete()
+        db.query(FileStore).filter(FileStore.id == "bench").delete()
+        db.add(FileStore(id="bench", file_data=inputs["pdf"], file_type="application/pdf", status="pending"))
+        db.commit()
+        process_pdf_conversion("bench", inputs["dpi"], db)
+
+    return run, inputs["pages"]
+
+def _prepare_split(inputs):
+    from app.services.split_service import split_pdf_by_mode
+    pages = inputs["pages"]
+    zip_path = tempfile.mktemp(prefix="bench_split_", suffix=".zip")
+    if inputs["mode"] == "every_n":
+        options = {"every_n": max(1, pages // 5)}
+    else:
+        # Aim for about five parts
+        options = {"max_bytes": max(1, len(inputs["pdf"]) // 5)}
+
+    def run():
+        # Documents from SPLIT_PARALLEL_MIN_PAGES pages up go through the worker pool (started by the warm-up run)
+        split_pdf_by_mode(inputs["pdf"], zip_path, inputs["mode"], **options)
+        os.remove(zip_path)
+
+    return run, pages
+
+def _prepare_merge(inputs):
+    from app.services.pdf_service import merge_pdfs_service
+    return (lambda: merge_pdfs_service(inputs["pdfs"])), inputs["pages"] * len(inputs["pdfs"])
+
+def _prepare_add_page_numbers(inputs):
+    from app.services.pdf_service import add_page_numbers_service
+    return (lambda: add_page_numbers_service(inputs["pdf"])), inputs["pages"]
+
+def _prepare_insert_image(inputs):
+    from app.services.pdf_service import insert_image_to_pdf
+    return (lambda: insert_image_to_pdf(inputs["pdf"], inputs["image"], 1)), 1
+
+def _check_insert_images(output: bytes, inputs, insertions):
+    """
+    Fails the case if images landed anywhere but before the original page their index names.
+    """
+    import hashlib
+    import fitz
+    slots = {hashlib.sha256(image).digest(): slot for slot, image in enumerate(inputs["images"])}
+    expected = []
+    for page in range(inputs["pages"] + 1):
+        expected += [f"image {inputs['images'].index(image)}" for image, index, _ in insertions if index == page]
+        if page < inputs["pages"]:
+            expected.append(f"page {page + 1}")
+    actual = []
+    with fitz.open(stream=output, filetype="pdf") as doc:
+        for page in doc:
+            images = page.get_images()
+            if images:
+                data = doc.extract_image(images[0][0])["image"]
+                actual.append(f"image {slots.get(hashlib.sha256(data).digest())}")
+            else:
+                actual.append(f"page {page.get_text().split(chr(10))[0].split()[-1]}")
+    if actual != expected:
+        raise AssertionError(f"insert_images_to_pdf placed pages as {actual}, expected {expected}")
+
+def _prepare_insert_images(inputs):
+    from app.services.pdf_service import insert_images_to_pdf
+    # Alternate two scans so half of the inserts reuse an already embedded image
+    insertions = [(inputs["images"][i % 2], i % inputs["pages"], "fit") for i in range(inputs["count"])]
+    # Check placement once, also with the indices given in descending order
+    for check in (insertions, insertions[::-1]):
+        _check_insert_images(insert_images_to_pdf(inputs["pdf"], check), inputs, check)
+    return (lambda: insert_images_to_pdf(inputs["pdf"], insertions)), inputs["count"]
+
+def _prepare_pdf_to_docx(inputs):
+    from app.services.pdf_service import pdf_to_docx_service
+    return (lambda: pdf_to_docx_service(inputs["pdf"])), inputs["pages"]
+
+def _prepare_zip_images(inputs):
+    from app.utils.zip_utils import create_zip_from_images
+    images = [SimpleNamespace(page_number=i + 1, image_data=inputs["image"], variant="default", image_format="png") for i in range(inputs["count"])]
+    return (lambda: create_zip_from_images(images)), _mb(inputs["image"]) * inputs["count"]
+
+def _prepare_zip_pdfs(inputs):
+    from app.utils.zip_utils import create_zip_from_pdfs
+    pdfs = [(f"part_{i}.pdf", inputs["pdf"]) for i in range(inputs["count"])]
+    return (lambda: create_zip_from_pdfs(pdfs)), _mb(inputs["pdf"]) * inputs["count"]
+
+# --- image-service ---------------------------------------------------------
+
+def _image_inputs(p):
+    return {
+        "image": make_image(p["width"], p["height"], p["format"], p["mode"]),
+        "megapixels": p["width"] * p["height"] / 1e6,
+    }
+
+def _prepare_convert_format(inputs):
+    from app.services.image_service import convert_image_format
+    return (lambda: convert_image_format(inputs["image"], inputs["target"])), inputs["megapixels"]
+
+def _prepare_edit_image(inputs):
+    from app.services.image_service import edit_image_service
+    return (lambda: edit_image_service(inputs["image"], 1.2, 1.1, 1.5, False, 90)), inputs["megapixels"]
+
+def _prepare_crop_image(inputs):
+    from app.services.image_service import crop_image_percentage
+    return (lambda: crop_image_percentage(inputs["image"], 10, 10, 5, 5)), inputs["megapixels"]
+
+def _prepare_images_to_pdf(inputs):
+    from app.services.image_service import images_to_pdf_service
+    return (lambda: images_to_pdf_service(inputs["images"])), len(inputs["images"])
+
+SIZES = [(800, 600), (4000, 3000)]
+
+CASES = [
+    Case(
+        "process_pdf_conversion", "pdf-service",
+        grid={"pages": [1, 10], "kind": ["vector", "image"], "dpi": [72, 150, 300]},
+        quick_grid={"pages": [2], "kind": ["vector", "image"], "dpi": [150]},
+        unit="pages",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", p["kind"]), "pages": p["pages"], "dpi": p["dpi"]},
+        prepare=_prepare_process_pdf_conversion,
+    ),
+    Case(
+        "split_pdf_by_mode", "pdf-service",
+        grid={"pages": [10, 200], "kind": ["vector", "image"], "mode": ["every_n", "max_size"]},
+        quick_grid={"pages": [10], "kind": ["vector"], "mode": ["every_n", "max_size"]},
+        unit="pages",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", p["kind"]), "pages": p["pages"], "mode": p["mode"]},
+        prepare=_prepare_split,
+    ),
+    Case(
+        "merge_pdfs_service", "pdf-service",
+        grid={"docs": [2, 10], "pages": [10, 50], "kind": ["vector", "image"]},
+        quick_grid={"docs": [2], "pages": [10], "kind": ["vector"]},
+        unit="pages",
+        make_inputs=lambda p: {"pdfs": [make_pdf(p["pages"], "a4", p["kind"], seed) for seed in range(p["docs"])], "pages": p["pages"]},
+        prepare=_prepare_merge,
+    ),
+    Case(
+        "add_page_numbers_service", "pdf-service",
+        grid={"pages": [10, 200], "page_size": ["a4", "a0"]},
+        quick_grid={"pages": [10], "page_size": ["a4"]},
+        unit="pages",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], p["page_size"], "vector"), "pages": p["pages"]},
+        prepare=_prepare_add_page_numbers,
+    ),
+    Case(
+        "insert_image_to_pdf", "pdf-service",
+        grid={"pages": [10, 100], "width": [800, 2480], "format": ["PNG", "JPEG"]},
+        quick_grid={"pages": [10], "width": [800], "format": ["PNG"]},
+        unit="inserts",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", "vector"), "image": make_image(p["width"], int(p["width"] * 1.414), p["format"], "RGB")},
+        prepare=_prepare_insert_image,
+    ),
+    Case(
+        "insert_images_to_pdf", "pdf-service",
+        grid={"pages": [10, 100], "count": [10, 50]},
+        quick_grid={"pages": [10], "count": [10]},
+        unit="inserts",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", "vector"), "images": [make_image(2480, 3508, "JPEG", "RGB", seed) for seed in range(2)], "pages": p["pages"], "count": p["count"]},
+        prepare=_prepare_insert_images,
+    ),
+    Case(
+        "pdf_to_docx_service", "pdf-service",
+        grid={"pages": [2, 10]},
+        quick_grid={"pages": [2]},
+        unit="pages",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", "vector"), "pages": p["pages"]},
+        prepare=_prepare_pdf_to_docx,
+    ),
+    Case(
+        "create_zip_from_images", "pdf-service",
+        grid={"count": [10, 100], "width": [1240, 2480]},
+        quick_grid={"count": [10], "width": [1240]},
+        unit="MB",
+        make_inputs=lambda p: {"image": make_image(p["width"], int(p["width"] * 1.414), "PNG", "RGB"), "count": p["count"]},
+        prepare=_prepare_zip_images,
+    ),
+    Case(
+        "create_zip_from_pdfs", "pdf-service",
+        grid={"count": [10, 100], "pages": [10]},
+        quick_grid={"count": [10], "pages": [10]},
+        unit="MB",
+        make_inputs=lambda p: {"pdf": make_pdf(p["pages"], "a4", "vector"), "count": p["count"]},
+        prepare=_prepare_zip_pdfs,
+    ),
+    Case(
+        "convert_image_format", "image-service",
+        grid={"size": SIZES, "format": ["PNG", "JPEG"], "mode": ["RGB", "RGBA"], "target": ["JPEG", "WEBP"]},
+        quick_grid={"size": SIZES[:1], "format": ["PNG"], "mode": ["RGB"], "target": ["JPEG"]},
+        unit="MP",
+        make_inputs=lambda p: {**_image_inputs({"width": p["size"][0], "height": p["size"][1], "format": p["format"], "mode": p["mode"]}), "target": p["target"]},
+        prepare=_prepare_convert_format,
+    ),
+    Case(
+        "edit_image_service", "image-service",
+        grid={"size": SIZES, "format": ["PNG", "JPEG"], "mode": ["RGB", "L"]},
+        quick_grid={"size": SIZES[:1], "format": ["PNG"], "mode": ["RGB"]},
+        unit="MP",
+        make_inputs=lambda p: _image_inputs({"width": p["size"][0], "height": p["size"][1], "format": p["format"], "mode": p["mode"]}),
+        prepare=_prepare_edit_image,
+    ),
+    Case(
+        "crop_image_percentage", "image-service",
+        grid={"size": SIZES, "format": ["PNG", "JPEG"], "mode": ["RGB", "RGBA"]},
+        quick_grid={"size": SIZES[:1], "format": ["PNG"], "mode": ["RGB"]},
+        unit="MP",
+        make_inputs=lambda p: _image_inputs({"width": p["size"][0], "height": p["size"][1], "format": p["format"], "mode": p["mode"]}),
+        prepare=_prepare_crop_image,
+    ),
+    Case(
+        "images_to_pdf_service", "image-service",
+        grid={"count": [1, 20], "format": ["JPEG", "PNG"]},
+        quick_grid={"count": [5], "format": ["JPEG"]},
+        unit="images",
+        make_inputs=lambda p: {"images": [make_image(1240, 1754, p["format"], "RGB", seed) for seed in range(p["count"])]},
+        prepare=_prepare_images_to_pdf,
+    ),
+]
+
+def _case_key(case: Case, params: dict) -> str:
+    return f"{case.name}[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+# --- measurement -----------------------------------------------------------
+
+def _rss_kb(field: str = "VmRSS") -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+def _release_free_memory():
+    # Hand freed heap back to the OS so the timed runs' peak is not hidden by warm-up allocations
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def _reset_peak_rss() -> bool:
+    # Writing 5 resets VmHWM to the current RSS (Linux >= 4.0)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def _run_case(case: Case, inputs: dict, repeat: int, conn):
+    try:
+        sys.path.insert(0, os.path.join(BACKEND_DIR, case.service))
+        logging.disable(logging.INFO) # pdf2docx logs every page
+        fn, units = case.prepare(inputs)
+        fn() # Warm-up: first-call imports and caches
+
+        _release_free_memory()
+        before_kb = _rss_kb()
+        peak_reset = _reset_peak_rss()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        if peak_reset:
+            peak_kb = _rss_kb("VmHWM")
+        else:
+            peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        median = statistics.median(times)
+        conn.send({
+            "min_s": min(times),
+            "median_s": median,
+            "throughput": units / median if median > 0 else 0.0,
+            "peak_mb": max(0, peak_kb - before_kb) / 1024,
+        })
+    except Exception:
+        conn.send({"error": traceback.format_exc()})
+    finally:
+        conn.close()
+
+def run_case(case: Case, params: dict, repeat: int) -> dict:
+    inputs = case.make_inputs(params)
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_case, args=(case, inputs, repeat, child_conn))
+    proc.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {"error": f"benchmark process exited with code {proc.exitcode}"}
+    proc.join()
+    return result
+
+# --- reporting -------------------------------------------------------------
+
+def compare(results: dict, baseline: dict, threshold: float, memory_threshold: float) -> list[str]:
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base or "error" in result or "error" in base:
+            continue
+        if result["median_s"] > base["median_s"] * (1 + threshold):
+            regressions.append(f"{key}: time {base['median_s'] * 1000:.1f}ms -> {result['median_s'] * 1000:.1f}ms")
+        # Ignore tiny absolute memory changes, which are mostly allocator noise
+        if result["peak_mb"] > base["peak_mb"] * (1 + memory_threshold) and result["peak_mb"] - base["peak_mb"] > 5:
+            regressions.append(f"{key}: peak memory {base['peak_mb']:.1f}MB -> {result['peak_mb']:.1f}MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion service functions")
+    parser.add_argument("-k", "--filter", default="", help="Only run cases whose name contains this string")
+    parser.add_argument("--quick", action="store_true", help="Run a reduced parameter grid")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (after one warm-up)")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--save-baseline", help="Save results as the baseline file")
+    parser.add_argument("--baseline", help="Compare against this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown before flagging a regression")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Allowed relative peak memory increase")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(f"{'case':<78} {'median':>10} {'min':>10} {'throughput':>16} {'peak':>9} {'vs base':>8}")
+    for case in CASES:
+        if args.filter not in case.name:
+            continue
+        for params in case.param_sets(args.quick):
+            key = _case_key(case, params)
+            result = run_case(case, params, args.repeat)
+            results[key] = result
+            if "error" in result:
+                print(f"{key:<78} ERROR\n{result['error']}")
+                continue
+            delta = ""
+            if key in baseline and "median_s" in baseline[key]:
+                delta = f"{(result['median_s'] / baseline[key]['median_s'] - 1) * 100:+.0f}%"
+            print(
+                f"{key:<78} {result['median_s'] * 1000:8.1f}ms {result['min_s'] * 1000:8.1f}ms "
+                f"{result['throughput']:9.2f} {case.unit + '/s':<6} {result['peak_mb']:7.1f}MB {delta:>8}"
+            )
+
+    payload = {"python": sys.version.split()[0], "quick": args.quick, "repeat": args.repeat, "results": results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(payload, f, indent=2, sort_keys=True)
+
+    if os.environ["MYSQL_URL"].endswith(f"easyconvert-bench-{os.getpid()}.db"):
+        db_path = os.environ["MYSQL_URL"].removeprefix("sqlite:///")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+    errors = [key for key, result in results.items() if "error" in result]
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold) if baseline else []
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+    if errors or regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
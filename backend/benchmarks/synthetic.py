@@ -0,0 +1,86 @@
+"""
+Deterministic generators for synthetic benchmark inputs.
+The same arguments always produce the same document/image content, so timings are comparable across runs.
+"""
+import io
+import random
+from functools import lru_cache
+import fitz
+from PIL import Image, ImageDraw
+
+PAGE_SIZES = {
+    "a4": (595, 842),
+    "letter": (612, 792),
+    "a3": (842, 1191),
+    "a0": (2384, 3370),
+}
+
+@lru_cache(maxsize=64)
+def make_image(width: int, height: int, fmt: str = "PNG", mode: str = "RGB", seed: int = 0) -> bytes:
+    """
+    Returns an encoded image with a gradient background and seeded shapes, which
+    compresses like a typical scan/photo rather than flat colour or pure noise.
+    """
+    rng = random.Random(seed)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (gradient, gradient.rotate(90).resize((width, height)), gradient.transpose(Image.FLIP_TOP_BOTTOM)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(1, max(2, width // 3)), y0 + rng.randrange(1, max(2, height // 3))
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), outline=color, width=3)
+
+    if mode != "RGB":
+        img = img.convert(mode)
+    fmt = "JPEG" if fmt.upper() == "JPG" else fmt.upper()
+    if fmt == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        img = img.convert("RGB")
+
+    output = io.BytesIO()
+    img.save(output, format=fmt)
+    return output.getvalue()
+
+def _draw_vector_page(page, rng: random.Random, page_num: int):
+    width, height = page.rect.width, page.rect.height
+    page.insert_text((72, 72), f"Synthetic page {page_num + 1}", fontsize=18)
+    y = 110
+    while y < height - 72:
+        words = " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")) for _ in range(12))
+        page.insert_text((72, y), words, fontsize=10)
+        y += 14
+    for _ in range(20):
+        x0, y0 = rng.uniform(0, width), rng.uniform(0, height)
+        x1, y1 = rng.uniform(0, width), rng.uniform(0, height)
+        color = (rng.random(), rng.random(), rng.random())
+        page.draw_line((x0, y0), (x1, y1), color=color, width=rng.uniform(0.5, 3))
+        page.draw_rect(fitz.Rect(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)), color=color, width=0.5)
+
+@lru_cache(maxsize=32)
+def make_pdf(pages: int, page_size: str = "a4", kind: str = "vector", seed: int = 0) -> bytes:
+    """
+    Returns a PDF with the given page count and size.
+    kind="vector": text and line art; kind="image": one full-page JPEG scan per page (distinct per page).
+    """
+    width, height = PAGE_SIZES[page_size]
+    rng = random.Random(seed)
+    doc = fitz.open()
+    try:
+        for page_num in range(pages):
+            page = doc.new_page(width=width, height=height)
+            if kind == "vector":
+                _draw_vector_page(page, rng, page_num)
+            elif kind == "image":
+                # ~150 dpi scan of the page
+                scan = make_image(int(width * 150 / 72), int(height * 150 / 72), "JPEG", "RGB", seed * 100003 + page_num)
+                page.insert_image(page.rect, stream=scan)
+            else:
+                raise ValueError(f"Unknown PDF kind: {kind}")
+        # Fixed metadata so the output bytes are stable
+        doc.set_metadata({"title": f"synthetic-{kind}-{pages}", "creationDate": "D:20240101000000", "modDate": "D:20240101000000"})
+        return doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    finally:
+        doc.close()
@@ -0,0 +1,265 @@
+import asyncio
+import json
+import os
+from collections import defaultdict
+import httpx
+from .metrics import ADMISSION_INFLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTED
+
+_SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+def parse_size(value: str) -> int:
+    """
+    Parses sizes like "200MB", "512KB" or "1048576".
+    """
+    value = value.strip().upper()
+    number = value.rstrip("KMGB")
+    return int(float(number) * _SIZE_UNITS[value[len(number):]])
+
+def parse_route_limits(value: str) -> dict[str, int]:
+    """
+    Parses "/upload=500MB,/image/=50MB" into {path prefix: bytes}.
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            prefix, size = item.split("=", 1)
+            limits[prefix.strip()] = parse_size(size)
+    return limits
+
+def _split(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+# Request body caps (enforced from Content-Length and while the body streams in)
+MAX_BODY_BYTES = parse_size(os.getenv("MAX_BODY_BYTES", "200MB"))
+ROUTE_BODY_LIMITS = parse_route_limits(os.getenv("ROUTE_BODY_LIMITS", "/upload=500MB,/pdf/merge-pdfs=500MB,/image/=50MB"))
+
+# Concurrency limits
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))
+MAX_CONCURRENT_PER_CLIENT = int(os.getenv("MAX_CONCURRENT_PER_CLIENT", "8"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64")) # Requests allowed to wait for a global slot
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")) # Seconds a request may wait before it is shed
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+# Load shedding on upstream saturation and Celery backlog
+MAX_UPSTREAM_INFLIGHT = {
+    "pdf": int(os.getenv("MAX_PDF_INFLIGHT", "32")),
+    "image": int(os.getenv("MAX_IMAGE_INFLIGHT", "32")),
+}
+CELERY_BACKLOG_THRESHOLD = int(os.getenv("CELERY_BACKLOG_THRESHOLD", "100"))
+BACKLOG_SHED_ROUTES = _split(os.getenv("BACKLOG_SHED_ROUTES", "/pdf/convert-pdf-async"))
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "2"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+# Exact paths, or prefixes when ending in "*", that bypass admission control
+ADMISSION_EXEMPT_PATHS = _split(os.getenv("ADMISSION_EXEMPT_PATHS", "/,/metrics,/db-stats,/upstreams,/docs,/openapi.json"))
+
+def _matches(path: str, pattern: str) -> bool:
+    return path.startswith(pattern[:-1]) if pattern.endswith("*") else path == pattern
+
+class AdmissionController:
+    """
+    Tracks in-flight requests and decides whether a new request is admitted.
+    All state lives on the event loop, so no locking is needed.
+    """
+
+    def __init__(self):
+        self.inflight = 0
+        self.queued = 0
+        self.client_inflight = defaultdict(int)
+        self.upstream_inflight = defaultdict(int)
+        self.celery_backlog = None
+        self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self._poll_task = None
+
+    def is_exempt(self, path: str) -> bool:
+        return any(_matches(path, pattern) for pattern in ADMISSION_EXEMPT_PATHS)
+
+    def body_limit(self, path: str) -> int:
+        # Longest matching prefix wins
+        best = None
+        for prefix in ROUTE_BODY_LIMITS:
+            if path.startswith(prefix) and (best is None or len(prefix) > len(best)):
+                best = prefix
+        return ROUTE_BODY_LIMITS[best] if best is not None else MAX_BODY_BYTES
+
+    @staticmethod
+    def upstream_for(path: str):
+        service = path.lstrip("/").split("/", 1)[0]
+        return service if service in MAX_UPSTREAM_INFLIGHT else None
+
+    def shed_reason(self, path: str):
+        upstream = self.upstream_for(path)
+        if upstream and self.upstream_inflight[upstream] >= MAX_UPSTREAM_INFLIGHT[upstream]:
+            return f"{upstream}_saturated"
+        if (
+            self.celery_backlog is not None
+            and self.celery_backlog >= CELERY_BACKLOG_THRESHOLD
+            and any(_matches(path, route) for route in BACKLOG_SHED_ROUTES)
+        ):
+            return "celery_backlog"
+        return None
+
+    async def acquire(self) -> bool:
+        """
+        Takes a global slot, waiting up to ADMISSION_QUEUE_TIMEOUT in a bounded queue.
+        Returns False when the queue is full or the wait times out.
+        """
+        if self._semaphore.locked() and self.queued >= ADMISSION_QUEUE_SIZE:
+            return False
+        self.queued += 1
+        ADMISSION_QUEUED.inc()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.queued -= 1
+            ADMISSION_QUEUED.dec()
+        self.inflight += 1
+        ADMISSION_INFLIGHT.inc()
+        return True
+
+    def release(self):
+        self.inflight -= 1
+        ADMISSION_INFLIGHT.dec()
+        self._semaphore.release()
+
+    async def _poll_celery_backlog(self, fetch_backlog):
+        while True:
+            try:
+                self.celery_backlog = await fetch_backlog()
+            except (httpx.HTTPError, ValueError):
+                # Unknown backlog: don't shed on stale data
+                self.celery_backlog = None
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+
+    def start(self, fetch_backlog):
+        """
+        Starts polling the Celery backlog; fetch_backlog is a coroutine function returning the queue depth.
+        """
+        if self._poll_task is None:
+            self._poll_task = asyncio.get_running_loop().create_task(self._poll_celery_backlog(fetch_backlog))
+
+    def stop(self):
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "queued": self.queued,
+            "upstream_inflight": dict(self.upstream_inflight),
+            "clients": len(self.client_inflight),
+            "celery_backlog": self.celery_backlog,
+        }
+
+admission = AdmissionController()
+
+def _client_id(scope) -> str:
+    if TRUST_FORWARDED_FOR:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+async def _reject(send, status: int, detail: str, retry_after: int = None):
+    headers = [(b"content-type", b"application/json")]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(retry_after).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()})
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware applying body size caps, concurrency limits and load shedding
+    before a request reaches the proxy routes.
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.controller.is_exempt(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        path = scope["path"]
+        limit = controller.body_limit(path)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                ADMISSION_REJECTED.labels("body_too_large").inc()
+                await _reject(send, 413, f"Request body exceeds the {limit} byte limit for this route")
+                return
+
+        reason = controller.shed_reason(path)
+        if reason:
+            ADMISSION_REJECTED.labels(reason).inc()
+            await _reject(send, 503, "Service is overloaded, please retry later", RETRY_AFTER_SECONDS)
+            return
+
+        client = _client_id(scope)
+        if controller.client_inflight[client] >= MAX_CONCURRENT_PER_CLIENT:
+            ADMISSION_REJECTED.labels("client_limit").inc()
+            await _reject(send, 429, "Too many concurrent requests from this client", RETRY_AFTER_SECONDS)
+            return
+
+        # Count the client before waiting so its queued requests also hit the per-client cap
+        controller.client_inflight[client] += 1
+        try:
+            if not await controller.acquire():
+                ADMISSION_REJECTED.labels("queue_full").inc()
+                await _reject(send, 503, "Service is overloaded, please retry later", RETRY_AFTER_SECONDS)
+                return
+            upstream = controller.upstream_for(path)
+            if upstream:
+                controller.upstream_inflight[upstream] += 1
+            try:
+                await self._call_with_body_limit(scope, receive, send, limit)
+            finally:
+                if upstream:
+                    controller.upstream_inflight[upstream] -= 1
+                controller.release()
+        finally:
+            controller.client_inflight[client] -= 1
+            if controller.client_inflight[client] <= 0:
+                del controller.client_inflight[client]
+
+    async def _call_with_body_limit(self, scope, receive, send, limit: int):
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Stop reading; the app sees a disconnect and its response is replaced below
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if too_large:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not too_large:
+                raise
+        if too_large and not response_started:
+            ADMISSION_REJECTED.labels("body_too_large").inc()
+            await _reject(send, 413, f"Request body exceeds the {limit} byte limit for this route")
@@ -1,15 +1,25 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
-import os
 import io
-from sqlalchemy.orm import Session
-from .database import get_db, init_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import get_async_db, init_db, get_pool_stats
+from .utils.loop_monitor import loop_monitor
+from .metrics import MetricsMiddleware, metrics_response, time_stage
+from .tracing import TracingMiddleware, inject_headers, setup_tracing
+from .admission import QUEUE_POLL_INTERVAL, AdmissionMiddleware, admission
+from .upstreams import create_client, pools
 from .services.file_service import save_upload_to_db
 from .schemas.file_schema import UploadResponse
 
+setup_tracing("gateway")
+
 app = FastAPI()
+# Innermost, so shed requests still get CORS headers, metrics and a trace
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 # Add CORS Middleware
 app.add_middleware(
@@ -25,16 +35,67 @@ app.add_middleware(
 def startup():
     init_db()
 
-# Get service URLs from environment variables
-PDF_SERVICE_URL = os.getenv("PDF_SERVICE_URL", "http://pdf-service:8001")
-IMAGE_SERVICE_URL = os.getenv("IMAGE_SERVICE_URL", "http://image-service:8002")
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor.stop()
+
+@app.on_event("startup")
+async def start_upstreams():
+    # One shared client for all proxied requests and health checks
+    app.state.upstream_client = create_client()
+    for pool in pools.values():
+        pool.start(app.state.upstream_client)
+
+    async def fetch_celery_backlog():
+        # Any PDF Service replica reports the same broker queue
+        # and a hung replica must not keep a stale backlog in place for the full upstream timeout
+        response = await pools["pdf"].send(
+            app.state.upstream_client, "GET", "queue-stats", timeout=QUEUE_POLL_INTERVAL
+        )
+        response.raise_for_status()
+        return response.json().get("celery_queue_depth")
+
+    # Poll the Celery backlog so async conversions can be shed before the queue runs away
+    admission.start(fetch_celery_backlog)
+
+@app.on_event("shutdown")
+async def stop_upstreams():
+    admission.stop()
+    for pool in pools.values():
+        pool.stop()
+    await app.state.upstream_client.aclose()
 
 @app.get("/")
 def read_root():
     return {"message": "Gateway Service is running"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
+@app.get("/db-stats")
+def db_stats(reset: bool = False):
+    """
+    Returns DB pool usage and event-loop lag measured since startup (or the last reset).
+    """
+    stats = {"pools": get_pool_stats(), "event_loop": loop_monitor.stats(), "admission": admission.stats()}
+    if reset:
+        loop_monitor.reset()
+    return stats
+
+@app.get("/upstreams")
+def upstream_stats():
+    """
+    Returns per-replica health, in-flight requests and latency for each upstream service.
+    """
+    return {service: pool.stats() for service, pool in pools.items()}
+
 @app.post("/upload", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_file(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     """
     Uploads a file to the database and returns the generated file ID.
     """
@@ -44,126 +105,82 @@ async def upload_file(file: UploadFile = File(...), db: Session = Depends(get_db
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
+async def _proxy(service: str, path: str, request: Request):
+    pool = pools[service]
+    client = request.app.state.upstream_client
+
+    # Prepare the request for the microservice
+    headers = dict(request.headers)
+    headers.pop("host", None) # Let httpx handle the host header
+    headers.pop("content-length", None) # Let httpx calculate content length
+    inject_headers(headers) # Propagate the trace to the microservice
+
+    # Read the body once, so a retry on another replica can resend it
+    method = request.method
+    kwargs = {"params": request.query_params, "headers": headers}
+    if method == "POST":
+        # Check if it's a multipart/form-data request
+        if "multipart/form-data" in request.headers.get("content-type", ""):
+            # Remove content-type so httpx can set the correct multipart boundary
+            headers.pop("content-type", None)
+            with time_stage(f"proxy_{service}", "parse_multipart"):
+                form = await request.form()
+                files_to_forward = []
+                data = {}
+
+                # Use .multi_items() to handle multiple files with the same key (e.g. List[UploadFile])
+                for key, value in form.multi_items():
+                    if hasattr(value, "filename") and value.filename:
+                        # httpx supports a list of tuples for multiple files with the same key
+                        files_to_forward.append((key, (value.filename, await value.read(), value.content_type)))
+                    else:
+                        data[key] = value
+            kwargs.update(data=data, files=files_to_forward)
+        else:
+            kwargs["content"] = await request.body()
+
+    # Forward the request to the least loaded replica
+    try:
+        response = await pool.send(client, method, path, **kwargs)
+    except httpx.RequestError as exc:
+        raise HTTPException(status_code=500, detail=f"Error connecting to {service} service: {exc}")
+
+    if response.status_code != 404:
+        # Label metrics by the upstream route instead of the catch-all proxy route
+        request.scope["metrics_route"] = f"/{service}/{path.split('/', 1)[0]}"
+
+    # Return the response from the microservice
+    content_type = response.headers.get("content-type", "")
+
+    # Forward errors from the microservice if they occur
+    if response.status_code >= 400:
+        try:
+            error_detail = response.json()
+        except:
+            error_detail = response.text
+        raise HTTPException(status_code=response.status_code, detail=error_detail)
+
+    # Handle PDF or Image streaming responses
+    if any(t in content_type for t in ["application/pdf", "image/"]):
+        return StreamingResponse(
+            io.BytesIO(response.content),
+            media_type=content_type,
+            headers={"Content-Disposition": response.headers.get("Content-Disposition")}
+        )
+
+    if "application/json" in content_type:
+        return response.json()
+
+    # Other payloads (e.g. ZIP archives) are passed through as raw bytes
+    passthrough_headers = {}
+    if "content-disposition" in response.headers:
+        passthrough_headers["Content-Disposition"] = response.headers["content-disposition"]
+    return Response(content=response.content, media_type=content_type or None, headers=passthrough_headers)
+
 @app.api_route("/pdf/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy_pdf(path: str, request: Request):
-    async with httpx.AsyncClient() as client:
-        url = f"{PDF_SERVICE_URL}/{path}"
-        
-        # Prepare the request for the microservice
-        headers = dict(request.headers)
-        headers.pop("host", None) # Let httpx handle the host header
-        headers.pop("content-length", None) # Let httpx calculate content length
-        
-        # Forward the request
-        try:
-            method = request.method
-            if method == "GET":
-                response = await client.get(url, params=request.query_params, headers=headers)
-            elif method == "POST":
-                # Check if it's a multipart/form-data request
-                if "multipart/form-data" in request.headers.get("content-type", ""):
-                    # Remove content-type so httpx can set the correct multipart boundary
-                    headers.pop("content-type", None)
-                    # Forwarding files is tricky with httpx, we'll read the body and forward
-                    form = await request.form()
-                    files_to_forward = []
-                    data = {}
-                    
-                    # Use .multi_items() to handle multiple files with the same key (e.g. List[UploadFile])
-                    for key, value in form.multi_items():
-                        if hasattr(value, "filename") and value.filename:
-                            # httpx supports a list of tuples for multiple files with the same key
-                            files_to_forward.append((key, (value.filename, await value.read(), value.content_type)))
-                        else:
-                            data[key] = value
-                            
-                    response = await client.post(url, data=data, files=files_to_forward, params=request.query_params, headers=headers)
-                else:
-                    content = await request.body()
-                    response = await client.post(url, content=content, params=request.query_params, headers=headers)
-            else:
-                response = await client.request(method, url, params=request.query_params, headers=headers)
-            
-            # Return the response from the microservice
-            content_type = response.headers.get("content-type", "")
-            
-            # Forward errors from the microservice if they occur
-            if response.status_code >= 400:
-                try:
-                    error_detail = response.json()
-                except:
-                    error_detail = response.text
-                raise HTTPException(status_code=response.status_code, detail=error_detail)
-
-            # Handle PDF streaming responses
-            if "application/pdf" in content_type:
-                return StreamingResponse(
-                    io.BytesIO(response.content),
-                    media_type="application/pdf",
-                    headers={"Content-Disposition": response.headers.get("Content-Disposition")}
-                )
-            
-            return response.json() if "application/json" in content_type else response.content
-        except httpx.RequestError as exc:
-            raise HTTPException(status_code=500, detail=f"Error connecting to PDF service: {exc}")
+    return await _proxy("pdf", path, request)
 
 @app.api_route("/image/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy_image(path: str, request: Request):
-    async with httpx.AsyncClient() as client:
-        url = f"{IMAGE_SERVICE_URL}/{path}"
-        
-        # Prepare the request for the microservice
-        headers = dict(request.headers)
-        headers.pop("host", None) # Let httpx handle the host header
-        headers.pop("content-length", None) # Let httpx calculate content length
-        
-        # Forward the request
-        try:
-            method = request.method
-            if method == "GET":
-                response = await client.get(url, params=request.query_params, headers=headers)
-            elif method == "POST":
-                # Check if it's a multipart/form-data request
-                if "multipart/form-data" in request.headers.get("content-type", ""):
-                    # Remove content-type so httpx can set the correct multipart boundary
-                    headers.pop("content-type", None)
-                    form = await request.form()
-                    files_to_forward = []
-                    data = {}
-                    
-                    # Use .multi_items() to handle multiple files with the same key
-                    for key, value in form.multi_items():
-                        if hasattr(value, "filename") and value.filename:
-                            files_to_forward.append((key, (value.filename, await value.read(), value.content_type)))
-                        else:
-                            data[key] = value
-                            
-                    response = await client.post(url, data=data, files=files_to_forward, params=request.query_params, headers=headers)
-                else:
-                    content = await request.body()
-                    response = await client.post(url, content=content, params=request.query_params, headers=headers)
-            else:
-                response = await client.request(method, url, params=request.query_params, headers=headers)
-            
-            # Return the response from the microservice
-            content_type = response.headers.get("content-type", "")
-            
-            # Forward errors from the microservice if they occur
-            if response.status_code >= 400:
-                try:
-                    error_detail = response.json()
-                except:
-                    error_detail = response.text
-                raise HTTPException(status_code=response.status_code, detail=error_detail)
-
-            # Handle PDF or Image streaming responses
-            if any(t in content_type for t in ["application/pdf", "image/"]):
-                return StreamingResponse(
-                    io.BytesIO(response.content),
-                    media_type=content_type,
-                    headers={"Content-Disposition": response.headers.get("Content-Disposition")}
-                )
-            
-            return response.json() if "application/json" in content_type else response.content
-        except httpx.RequestError as exc:
-            raise HTTPException(status_code=500, detail=f"Error connecting to Image service: {exc}")
+    return await _proxy("image", path, request)
@@ -1,9 +1,10 @@
 from fastapi import UploadFile
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from ..database import FileStore
+from ..metrics import time_stage
 import uuid
 
-async def save_upload_to_db(file: UploadFile, db: Session) -> str:
+async def save_upload_to_db(file: UploadFile, db: AsyncSession) -> str:
     """
     Saves an UploadFile into the database and returns the generated ID.
     """
@@ -21,9 +22,9 @@ async def save_upload_to_db(file: UploadFile, db: Session) -> str:
         status="pending"
     )
     
-    # Add to database
-    db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+    # Add to database (async commit keeps the event loop free during the BLOB write)
+    with time_stage("upload", "db_write"):
+        db.add(new_file)
+        await db.commit()
     
     return file_id
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import random
+import time
+import httpx
+from .metrics import UPSTREAM_HEALTHY, UPSTREAM_INFLIGHT, UPSTREAM_LATENCY
+
+# Timeouts for proxied requests; conversions of large files can take minutes
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "300"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+
+# Active health checks against each replica's "/" endpoint
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+
+# Ejection: after EJECT_AFTER_FAILURES consecutive failures a replica is taken out of rotation
+# for EJECT_BASE_SECONDS, doubling on every re-ejection up to EJECT_MAX_SECONDS
+EJECT_AFTER_FAILURES = int(os.getenv("EJECT_AFTER_FAILURES", "3"))
+EJECT_BASE_SECONDS = float(os.getenv("EJECT_BASE_SECONDS", "5"))
+EJECT_MAX_SECONDS = float(os.getenv("EJECT_MAX_SECONDS", "120"))
+
+# Extra attempts on another replica for idempotent requests
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "1"))
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {502, 503, 504}
+
+def _urls(list_var: str, single_var: str, default: str) -> list[str]:
+    """
+    Reads a comma-separated replica list, falling back to the single-URL variable.
+    """
+    value = os.getenv(list_var) or os.getenv(single_var, default)
+    return [url.strip().rstrip("/") for url in value.split(",") if url.strip()]
+
+class Replica:
+    """
+    One upstream instance with its in-flight count, latency and health state.
+    """
+
+    def __init__(self, service: str, url: str):
+        self.service = service
+        self.url = url
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = 0.0
+        self.healthy = True
+        self.ejections = 0
+        self.backoff = 0.0
+        self.ejected_until = 0.0
+        self.last_error = None
+
+    def record(self, elapsed: float, ok: bool, error: str = None):
+        self.requests += 1
+        self.latency_ewma = elapsed if self.requests == 1 else 0.8 * self.latency_ewma + 0.2 * elapsed
+        if ok:
+            self.consecutive_failures = 0
+        else:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 2),
+            "ejections": self.ejections,
+            "ejected_for_seconds": round(max(0.0, self.ejected_until - time.monotonic()), 1),
+            "last_error": self.last_error,
+        }
+
+class UpstreamPool:
+    """
+    Balances requests across the replicas of one service with least-outstanding-requests.
+    """
+
+    def __init__(self, service: str, urls: list[str]):
+        self.service = service
+        self.replicas = [Replica(service, url) for url in urls]
+        self._health_task = None
+        for replica in self.replicas:
+            UPSTREAM_HEALTHY.labels(service, replica.url).set(1)
+
+    def pick(self, exclude=()) -> Replica:
+        """
+        Returns the healthy replica with the fewest in-flight requests (ties broken by latency, then randomly).
+        If every candidate is ejected, the one due back soonest is used rather than failing outright.
+        """
+        candidates = [r for r in self.replicas if r not in exclude]
+        if not candidates:
+            return None
+        healthy = [r for r in candidates if r.healthy]
+        if not healthy:
+            return min(candidates, key=lambda r: r.ejected_until)
+        return min(healthy, key=lambda r: (r.inflight, r.latency_ewma, random.random()))
+
+    def eject(self, replica: Replica, reason: str):
+        replica.healthy = False
+        replica.ejections += 1
+        replica.backoff = min(replica.backoff * 2, EJECT_MAX_SECONDS) if replica.backoff else EJECT_BASE_SECONDS
+        replica.ejected_until = time.monotonic() + replica.backoff
+        replica.last_error = reason
+        UPSTREAM_HEALTHY.labels(self.service, replica.url).set(0)
+        print(f"Ejected {self.service} replica {replica.url} for {replica.backoff:.0f}s: {reason}")
+
+    def readmit(self, replica: Replica):
+        replica.healthy = True
+        replica.consecutive_failures = 0
+        UPSTREAM_HEALTHY.labels(self.service, replica.url).set(1)
+        print(f"Re-admitted {self.service} replica {replica.url}")
+
+    def _record(self, replica: Replica, elapsed: float, ok: bool, error: str = None):
+        replica.record(elapsed, ok, error)
+        if not ok and replica.healthy and replica.consecutive_failures >= EJECT_AFTER_FAILURES:
+            self.eject(replica, error)
+
+    async def send(self, client: httpx.AsyncClient, method: str, path: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request to the least loaded replica. Idempotent requests are retried on another
+        replica after connection errors or 502/503/504; other methods only when the connection failed.
+        """
+        tried = []
+        while True:
+            replica = self.pick(exclude=tried)
+            if replica is None:
+                raise httpx.ConnectError(f"No {self.service} replica available")
+            tried.append(replica)
+            can_retry = len(tried) <= UPSTREAM_RETRIES and len(tried) < len(self.replicas)
+
+            replica.inflight += 1
+            UPSTREAM_INFLIGHT.labels(self.service, replica.url).inc()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, f"{replica.url}/{path}", **kwargs)
+            except httpx.RequestError as exc:
+                self._record(replica, time.perf_counter() - start, False, repr(exc))
+                # A failed connect never reached the replica, so even POSTs are safe to resend
+                if can_retry and (method in IDEMPOTENT_METHODS or isinstance(exc, httpx.ConnectError)):
+                    continue
+                raise
+            finally:
+                replica.inflight -= 1
+                UPSTREAM_INFLIGHT.labels(self.service, replica.url).dec()
+
+            elapsed = time.perf_counter() - start
+            failed = response.status_code in RETRY_STATUSES
+            self._record(replica, elapsed, not failed, f"HTTP {response.status_code}" if failed else None)
+            UPSTREAM_LATENCY.labels(self.service, replica.url, method, str(response.status_code)).observe(elapsed)
+            if failed and can_retry and method in IDEMPOTENT_METHODS:
+                continue
+            return response
+
+    async def _check(self, client: httpx.AsyncClient, replica: Replica):
+        try:
+            response = await client.get(f"{replica.url}/", timeout=HEALTH_CHECK_TIMEOUT)
+            ok = response.status_code == 200
+            error = f"health check returned HTTP {response.status_code}"
+        except httpx.HTTPError as exc:
+            ok, error = False, f"health check failed: {exc!r}"
+
+        if ok and not replica.healthy:
+            self.readmit(replica)
+        elif ok:
+            # Healthy for a full interval: the next ejection starts from the base backoff again
+            replica.backoff = 0.0
+        else:
+            # Replicas still down after their backoff are ejected again for longer
+            self.eject(replica, error)
+
+    async def _health_loop(self, client: httpx.AsyncClient):
+        while True:
+            now = time.monotonic()
+            due = [r for r in self.replicas if r.healthy or now >= r.ejected_until]
+            await asyncio.gather(*(self._check(client, replica) for replica in due))
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+    def start(self, client: httpx.AsyncClient):
+        if self._health_task is None:
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop(client))
+
+    def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> list[dict]:
+        return [replica.stats() for replica in self.replicas]
+
+pools = {
+    "pdf": UpstreamPool("pdf", _urls("PDF_SERVICE_URLS", "PDF_SERVICE_URL", "http://pdf-service:8001")),
+    "image": UpstreamPool("image", _urls("IMAGE_SERVICE_URLS", "IMAGE_SERVICE_URL", "http://image-service:8002")),
+}
+
+def create_client() -> httpx.AsyncClient:
+    """
+    One shared client for all proxied requests, so connections to the replicas are reused.
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS),
+    )
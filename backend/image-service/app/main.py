@@ -2,6 +2,8 @@ import io
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from typing import List, Optional, Annotated
+from .metrics import MetricsMiddleware, metrics_response
+from .tracing import TracingMiddleware, setup_tracing
 from .services.image_service import (
     convert_image_format,
     images_to_pdf_service,
@@ -9,12 +11,20 @@ from .services.image_service import (
     crop_image_percentage
 )
 
+setup_tracing("image-service")
+
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 @app.get("/")
 def read_root():
     return {"message": "Image Service is running"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
 @app.post("/change-format")
 async def change_format(
     file: UploadFile = File(...),
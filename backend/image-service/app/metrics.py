@@ -0,0 +1,109 @@
+import os
+import time
+from contextlib import contextmanager
+from fastapi import Response
+from .tracing import tracer
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets sized for file conversions: from sub-10ms JSON calls to multi-minute renders
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REQUEST_LATENCY = Histogram(
+    "easyconvert_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_BYTES = Counter(
+    "easyconvert_http_request_bytes",
+    "Request body bytes received by route",
+    ["method", "route"],
+)
+RESPONSE_BYTES = Counter(
+    "easyconvert_http_response_bytes",
+    "Response body bytes sent by route",
+    ["method", "route"],
+)
+STAGE_LATENCY = Histogram(
+    "easyconvert_stage_duration_seconds",
+    "Time spent in each processing stage",
+    ["operation", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+
+@contextmanager
+def time_stage(operation: str, stage: str):
+    """
+    Records the duration of one processing stage in STAGE_LATENCY, as a child span of the current trace.
+    """
+    start = time.perf_counter()
+    with tracer.start_as_current_span(f"{operation}.{stage}"):
+        try:
+            yield
+        finally:
+            STAGE_LATENCY.labels(operation, stage).observe(time.perf_counter() - start)
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route latency and body byte counts.
+    Routes are labelled with their template (e.g. /status/{task_id}) unless a
+    handler sets scope["metrics_route"] to something more specific.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        request_bytes = 0
+        response_bytes = 0
+        status = 500
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            route = scope.get("metrics_route")
+            if route is None:
+                matched = scope.get("route")
+                route = matched.path if matched is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - start)
+            REQUEST_BYTES.labels(method, route).inc(request_bytes)
+            RESPONSE_BYTES.labels(method, route).inc(response_bytes)
+
+def _registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def metrics_response() -> Response:
+    return Response(generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -1,12 +1,15 @@
 import io
 from PIL import Image, ImageEnhance, ImageOps
 import img2pdf
+from ..metrics import time_stage
 
 def convert_image_format(image_bytes: bytes, target_format: str) -> bytes:
     """
     Changes image format (e.g., PNG to JPG, WEBP to PNG).
     """
-    img = Image.open(io.BytesIO(image_bytes))
+    with time_stage("change_format", "open"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load() # Pillow decodes lazily; force it so decode time lands in this stage
     
     # Normalize format name for Pillow
     target_format = target_format.upper()
@@ -14,19 +17,22 @@ def convert_image_format(image_bytes: bytes, target_format: str) -> bytes:
         target_format = "JPEG"
     
     # Handle transparency if converting to JPEG
-    if target_format == "JPEG" and img.mode in ("RGBA", "P"):
-        img = img.convert("RGB")
+    with time_stage("change_format", "transform"):
+        if target_format == "JPEG" and img.mode in ("RGBA", "P"):
+            img = img.convert("RGB")
     
-    output = io.BytesIO()
-    img.save(output, format=target_format)
-    return output.getvalue()
+    with time_stage("change_format", "save"):
+        output = io.BytesIO()
+        img.save(output, format=target_format)
+        return output.getvalue()
 
 def images_to_pdf_service(image_list: list[bytes]) -> bytes:
     """
     Converts one or more images into a single PDF file.
     """
-    # img2pdf is efficient for this
-    return img2pdf.convert(image_list)
+    # img2pdf is efficient for this (it embeds JPEG/PNG data without re-encoding)
+    with time_stage("images_to_pdf", "save"):
+        return img2pdf.convert(image_list)
 
 def edit_image_service(
     image_bytes: bytes, 
@@ -39,31 +45,35 @@ def edit_image_service(
     """
     Edits image: brightness, contrast, sharpness, grayscale, and rotation.
     """
-    img = Image.open(io.BytesIO(image_bytes))
+    with time_stage("edit_image", "open"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
     
-    if grayscale:
-        img = ImageOps.grayscale(img)
+    with time_stage("edit_image", "transform"):
+        if grayscale:
+            img = ImageOps.grayscale(img)
+            
+        if brightness != 1.0:
+            enhancer = ImageEnhance.Brightness(img)
+            img = enhancer.enhance(brightness)
+            
+        if contrast != 1.0:
+            enhancer = ImageEnhance.Contrast(img)
+            img = enhancer.enhance(contrast)
+            
+        if sharpness != 1.0:
+            enhancer = ImageEnhance.Sharpness(img)
+            img = enhancer.enhance(sharpness)
+            
+        if rotate != 0:
+            img = img.rotate(rotate, expand=True)
         
-    if brightness != 1.0:
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(brightness)
-        
-    if contrast != 1.0:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(contrast)
-        
-    if sharpness != 1.0:
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(sharpness)
-        
-    if rotate != 0:
-        img = img.rotate(rotate, expand=True)
-        
-    output = io.BytesIO()
-    # Preserve original format or default to PNG
-    save_format = img.format if img.format else "PNG"
-    img.save(output, format=save_format)
-    return output.getvalue()
+    with time_stage("edit_image", "save"):
+        output = io.BytesIO()
+        # Preserve original format or default to PNG
+        save_format = img.format if img.format else "PNG"
+        img.save(output, format=save_format)
+        return output.getvalue()
 
 def crop_image_percentage(
     image_bytes: bytes, 
@@ -75,7 +85,9 @@ def crop_image_percentage(
     """
     Crops image from sides as percentage.
     """
-    img = Image.open(io.BytesIO(image_bytes))
+    with time_stage("crop_image", "open"):
+        img = Image.open(io.BytesIO(image_bytes))
+        img.load()
     width, height = img.size
     
     left = width * (left_pct / 100)
@@ -83,9 +95,11 @@ def crop_image_percentage(
     right = width * (1 - right_pct / 100)
     bottom = height * (1 - bottom_pct / 100)
     
-    img = img.crop((left, top, right, bottom))
+    with time_stage("crop_image", "transform"):
+        img = img.crop((left, top, right, bottom))
     
-    output = io.BytesIO()
-    save_format = img.format if img.format else "PNG"
-    img.save(output, format=save_format)
-    return output.getvalue()
+    with time_stage("crop_image", "save"):
+        output = io.BytesIO()
+        save_format = img.format if img.format else "PNG"
+        img.save(output, format=save_format)
+        return output.getvalue()
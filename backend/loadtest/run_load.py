@@ -0,0 +1,514 @@
+"""
+End-to-end load harness. Boots the gateway, pdf-service, image-service and a
+Celery worker on this machine against local stand-ins (SQLite + the Celery
+"filesystem://" broker, or a local Redis via --redis-url), drives a weighted
+mix of requests through the gateway at a target arrival rate, and reports
+latency percentiles, throughput, error rate and per-process RSS.
+Requests come from --clients simulated users (distinct X-Forwarded-For
+addresses), so the gateway's per-client admission limit applies per user;
+429s and load-shedding 503s are reported as rejections, not errors.
+
+    python loadtest/run_load.py --rate 5 --duration 60
+    python loadtest/run_load.py --rate 20 --mix upload=1,pdf_sync=2,image_sync=4,async_raster=1 --json load.json
+    python loadtest/run_load.py --gateway-url http://localhost:8000 --rate 5   # against running services
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+
+from synthetic import make_image, make_pdf  # noqa: E402
+
+DEFAULT_MIX = "upload=1,pdf_sync=3,image_sync=3,async_raster=1"
+
+# --- local stack -----------------------------------------------------------
+
+class LocalStack:
+    """
+    Starts the services as child processes sharing a SQLite database and broker folder under workdir.
+    """
+
+    def __init__(self, workdir: str, base_port: int, worker_concurrency: int, redis_url: str = None):
+        self.workdir = workdir
+        self.ports = {"gateway": base_port, "pdf-service": base_port + 1, "image-service": base_port + 2}
+        self.worker_concurrency = worker_concurrency
+        self.redis_url = redis_url
+        self.processes = {}
+        self._logs = []
+
+    @property
+    def gateway_url(self) -> str:
+        return f"http://127.0.0.1:{self.ports['gateway']}"
+
+    def _env(self) -> dict:
+        db_path = os.path.join(self.workdir, "easyconvert.db")
+        env = dict(os.environ)
+        env.update({
+            "MYSQL_URL": f"sqlite:///{db_path}",
+            "PDF_SERVICE_URL": f"http://127.0.0.1:{self.ports['pdf-service']}",
+            "IMAGE_SERVICE_URL": f"http://127.0.0.1:{self.ports['image-service']}",
+            "TRACE_EXPORTER": env.get("TRACE_EXPORTER", "file"),
+            "TRACE_FILE": os.path.join(self.workdir, "traces.jsonl"),
+            # Simulated users are told apart by X-Forwarded-For, as behind a load balancer
+            "TRUST_FORWARDED_FOR": "true",
+        })
+        if self.redis_url:
+            env["CELERY_BROKER_URL"] = self.redis_url
+            env["CELERY_RESULT_BACKEND"] = self.redis_url
+        else:
+            results_dir = os.path.join(self.workdir, "results")
+            os.makedirs(results_dir, exist_ok=True)
+            env["CELERY_BROKER_URL"] = "filesystem://"
+            env["CELERY_FILESYSTEM_DIR"] = os.path.join(self.workdir, "broker")
+            env["CELERY_RESULT_BACKEND"] = f"file://{results_dir}"
+        return env
+
+    def _spawn(self, name: str, service: str, args: list[str]):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        self._logs.append(log)
+        self.processes[name] = subprocess.Popen(
+            [sys.executable, "-m", *args],
+            cwd=os.path.join(BACKEND_DIR, service),
+            env=self._env(),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+    def _spawn_api(self, service: str):
+        self._spawn(service, service, [
+            "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(self.ports[service]),
+            "--log-level", "warning",
+        ])
+
+    def _wait_http(self, service: str, timeout: float = 60):
+        url = f"http://127.0.0.1:{self.ports[service]}/"
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processes[service].poll() is not None:
+                raise RuntimeError(f"{service} exited during startup, see {self.workdir}/{service}.log")
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{service} did not become healthy within {timeout}s")
+
+    def _wait_worker(self, timeout: float = 60):
+        log_path = os.path.join(self.workdir, "pdf-worker.log")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processes["pdf-worker"].poll() is not None:
+                raise RuntimeError(f"pdf-worker exited during startup, see {log_path}")
+            with open(log_path) as f:
+                if " ready." in f.read():
+                    return
+            time.sleep(0.2)
+        raise RuntimeError(f"pdf-worker did not become ready within {timeout}s")
+
+    def start(self):
+        # WAL lets the services and the worker read while another process writes
+        db = sqlite3.connect(os.path.join(self.workdir, "easyconvert.db"))
+        db.execute("PRAGMA journal_mode=WAL")
+        db.close()
+
+        # pdf-service first: it creates the tables the gateway and worker share
+        self._spawn_api("pdf-service")
+        self._wait_http("pdf-service")
+        self._spawn_api("image-service")
+        self._spawn("pdf-worker", "pdf-service", [
+            "celery", "-A", "app.celery_app", "worker", "--loglevel", "info",
+            "--concurrency", str(self.worker_concurrency),
+        ])
+        self._spawn_api("gateway")
+        self._wait_http("image-service")
+        self._wait_http("gateway")
+        self._wait_worker()
+
+    def stop(self):
+        for proc in self.processes.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.processes.values():
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for log in self._logs:
+            log.close()
+
+# --- process memory --------------------------------------------------------
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def _children(pid: int) -> list[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+def process_tree_rss_mb(pid: int) -> float:
+    """
+    RSS of a process plus all its descendants (e.g. Celery prefork children).
+    """
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += _rss_kb(current)
+        pending.extend(_children(current))
+    return total / 1024
+
+async def sample_rss(processes: dict, samples: dict, interval: float = 1.0):
+    while True:
+        for name, proc in processes.items():
+            if proc.poll() is None:
+                samples[name].append(process_tree_rss_mb(proc.pid))
+        await asyncio.sleep(interval)
+
+# --- workload --------------------------------------------------------------
+
+# Returned by timed() when admission control turned the request away
+REJECTED = object()
+
+def is_rejection(response: httpx.Response) -> bool:
+    # 429: per-client limit; 503 with Retry-After: the gateway shedding load (upstream failures carry no Retry-After)
+    return response.status_code == 429 or (response.status_code == 503 and "retry-after" in response.headers)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+        self.rejected = defaultdict(lambda: defaultdict(int))
+        self.dropped = 0
+
+    def record(self, op: str, seconds: float, ok: bool, detail: str = None):
+        self.latencies[op].append(seconds)
+        if not ok:
+            self.errors[op] += 1
+            if detail and op not in self.error_samples:
+                self.error_samples[op] = detail
+
+    def reject(self, op: str, status: int):
+        # Kept out of the latencies, which describe requests that were actually served
+        self.rejected[op][status] += 1
+
+class SimulatedClient:
+    """
+    One simulated user on the shared connection pool, identified to the gateway by X-Forwarded-For.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, address: str):
+        self._client = client
+        self._headers = {"X-Forwarded-For": address}
+
+    def get(self, url, **kwargs):
+        return self._client.get(url, headers=self._headers, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._client.post(url, headers=self._headers, **kwargs)
+
+class Payloads:
+    """
+    Deterministic request bodies, generated once before the run.
+    """
+
+    def __init__(self):
+        self.pdf = make_pdf(5, "a4", "vector", seed=1)
+        self.pdf_other = make_pdf(5, "a4", "vector", seed=2)
+        self.scan_pdf = make_pdf(3, "a4", "image", seed=3)
+        self.photo = make_image(1240, 1754, "JPEG", "RGB", seed=4)
+        self.graphic = make_image(800, 600, "PNG", "RGBA", seed=5)
+
+async def timed(recorder: Recorder, op: str, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        if is_rejection(response):
+            recorder.reject(op, response.status_code)
+            return REJECTED
+        ok = response.status_code < 400
+        recorder.record(op, time.perf_counter() - start, ok, None if ok else f"{response.status_code}: {response.text[:200]}")
+        return response if ok else None
+    except httpx.HTTPError as exc:
+        recorder.record(op, time.perf_counter() - start, False, repr(exc))
+        return None
+
+async def scenario_upload(client, p: Payloads, rng, recorder, args):
+    await timed(recorder, "upload", client.post("/upload", files={"file": ("doc.pdf", p.pdf, "application/pdf")}))
+
+async def scenario_pdf_sync(client, p: Payloads, rng, recorder, args):
+    op = rng.choice(("merge-pdfs", "add-page-numbers", "split-pdf", "insert-image"))
+    if op == "merge-pdfs":
+        files = [("files", ("a.pdf", p.pdf, "application/pdf")), ("files", ("b.pdf", p.pdf_other, "application/pdf"))]
+        request = client.post("/pdf/merge-pdfs", files=files)
+    elif op == "add-page-numbers":
+        request = client.post("/pdf/add-page-numbers", files={"file": ("doc.pdf", p.pdf, "application/pdf")})
+    elif op == "split-pdf":
+        request = client.post("/pdf/split-pdf", params={"ranges": "1-2, 3-5"}, files={"file": ("doc.pdf", p.pdf, "application/pdf")})
+    else:
+        files = {"pdf_file": ("doc.pdf", p.pdf, "application/pdf"), "image_file": ("photo.jpg", p.photo, "image/jpeg")}
+        request = client.post("/pdf/insert-image", params={"split_index": 1}, files=files)
+    await timed(recorder, f"pdf/{op}", request)
+
+async def scenario_image_sync(client, p: Payloads, rng, recorder, args):
+    op = rng.choice(("change-format", "edit-image", "crop-image", "images-to-pdf"))
+    if op == "change-format":
+        request = client.post("/image/change-format", params={"target_format": "WEBP"}, files={"file": ("g.png", p.graphic, "image/png")})
+    elif op == "edit-image":
+        request = client.post("/image/edit-image", params={"contrast": 1.2, "rotate": 90}, files={"file": ("photo.jpg", p.photo, "image/jpeg")})
+    elif op == "crop-image":
+        request = client.post("/image/crop-image", params={"left": 10, "top": 10}, files={"file": ("photo.jpg", p.photo, "image/jpeg")})
+    else:
+        files = [("files", (f"{i}.jpg", p.photo, "image/jpeg")) for i in range(3)]
+        request = client.post("/image/images-to-pdf", files=files)
+    await timed(recorder, f"image/{op}", request)
+
+async def scenario_async_raster(client, p: Payloads, rng, recorder, args):
+    start = time.perf_counter()
+    response = await timed(
+        recorder, "pdf/convert-pdf-async",
+        client.post("/pdf/convert-pdf-async", params={"dpi": args.dpi}, files={"file": ("scan.pdf", p.scan_pdf, "application/pdf")}),
+    )
+    if response is REJECTED:
+        # Counted against pdf/convert-pdf-async; the job never started
+        return
+    if response is None:
+        recorder.record("async_job", time.perf_counter() - start, False)
+        return
+    task_id = response.json()["task_id"]
+
+    # Poll until the worker finishes, then download (which also cleans up the job)
+    status = "pending"
+    deadline = time.monotonic() + args.job_timeout
+    while status not in ("completed", "failed") and time.monotonic() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        status_response = await timed(recorder, "pdf/status", client.get(f"/pdf/status/{task_id}"))
+        if status_response is not None and status_response is not REJECTED:
+            status = status_response.json()["status"]
+
+    if status != "completed":
+        recorder.record("async_job", time.perf_counter() - start, False, f"job {task_id} ended as {status}")
+        return
+    download = await timed(recorder, "pdf/download-images", client.get(f"/pdf/download-images/{task_id}"))
+    if download is REJECTED:
+        # Counted against pdf/download-images; the job itself completed
+        recorder.record("async_job", time.perf_counter() - start, True)
+        return
+    recorder.record("async_job", time.perf_counter() - start, download is not None)
+
+SCENARIOS = {
+    "upload": scenario_upload,
+    "pdf_sync": scenario_pdf_sync,
+    "image_sync": scenario_image_sync,
+    "async_raster": scenario_async_raster,
+}
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+async def drive_load(args, gateway_url: str, recorder: Recorder) -> float:
+    """
+    Open-loop arrivals: requests start on schedule whether or not earlier ones finished,
+    so an overloaded system shows up as rising latency rather than a lower send rate.
+    """
+    rng = random.Random(args.seed)
+    payloads = Payloads()
+    weights = parse_mix(args.mix)
+    names, values = list(weights), list(weights.values())
+
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=args.max_inflight)
+    async with httpx.AsyncClient(base_url=gateway_url, timeout=args.request_timeout, limits=limits) as client:
+        users = [SimulatedClient(client, f"10.0.{i // 256}.{i % 256}") for i in range(args.clients)]
+        loop = asyncio.get_running_loop()
+        inflight = set()
+        start = loop.time()
+        next_at = start
+        while next_at - start < args.duration:
+            await asyncio.sleep(max(0.0, next_at - loop.time()))
+            if len(inflight) >= args.max_inflight:
+                recorder.dropped += 1
+            else:
+                scenario = SCENARIOS[rng.choices(names, values)[0]]
+                user = rng.choice(users)
+                task = asyncio.create_task(scenario(user, payloads, random.Random(rng.random()), recorder, args))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+            next_at += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+
+        if inflight:
+            await asyncio.wait(inflight, timeout=args.drain_timeout)
+            for task in inflight:
+                task.cancel()
+        return loop.time() - start
+
+# --- report ----------------------------------------------------------------
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def build_report(recorder: Recorder, elapsed: float, rss_samples: dict) -> dict:
+    operations = {}
+    total = errors = rejected = 0
+    for op in sorted(set(recorder.latencies) | set(recorder.rejected)):
+        values = sorted(recorder.latencies[op])
+        op_rejected = recorder.rejected[op]
+        count = len(values) + sum(op_rejected.values())
+        total += count
+        errors += recorder.errors[op]
+        rejected += sum(op_rejected.values())
+        operations[op] = {
+            "count": count,
+            "errors": recorder.errors[op],
+            "error_rate": recorder.errors[op] / count,
+            "rejected": dict(op_rejected),
+            "rejected_rate": sum(op_rejected.values()) / count,
+            "throughput_rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "max_ms": values[-1] * 1000 if values else 0.0,
+        }
+    memory = {
+        name: {"mean_mb": sum(samples) / len(samples), "max_mb": max(samples)}
+        for name, samples in rss_samples.items() if samples
+    }
+    return {
+        "elapsed_s": elapsed,
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "rejected": rejected,
+        "rejected_rate": rejected / total if total else 0.0,
+        "throughput_rps": (total - rejected) / elapsed if elapsed else 0.0,
+        "dropped": recorder.dropped,
+        "operations": operations,
+        "rss": memory,
+        "error_samples": recorder.error_samples,
+    }
+
+def print_report(report: dict):
+    print(
+        f"\n{'operation':<26} {'count':>7} {'err%':>6} {'429':>5} {'503':>5} "
+        f"{'rps':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
+    )
+    for op, stats in report["operations"].items():
+        rejected = stats["rejected"]
+        print(
+            f"{op:<26} {stats['count']:7d} {stats['error_rate'] * 100:5.1f}% "
+            f"{rejected.get(429, 0):5d} {rejected.get(503, 0):5d} {stats['throughput_rps']:7.2f} "
+            f"{stats['p50_ms']:7.0f}ms {stats['p95_ms']:7.0f}ms {stats['p99_ms']:7.0f}ms {stats['max_ms']:7.0f}ms"
+        )
+    print(
+        f"\nTotal: {report['requests']} requests in {report['elapsed_s']:.1f}s "
+        f"({report['throughput_rps']:.2f} served req/s), error rate {report['error_rate'] * 100:.2f}%, "
+        f"rejected by admission control {report['rejected_rate'] * 100:.2f}%, "
+        f"dropped by client (max in-flight reached): {report['dropped']}"
+    )
+    if report["rss"]:
+        print(f"\n{'process':<16} {'mean RSS':>10} {'max RSS':>10}")
+        for name, stats in report["rss"].items():
+            print(f"{name:<16} {stats['mean_mb']:8.1f}MB {stats['max_mb']:8.1f}MB")
+    for op, detail in report["error_samples"].items():
+        print(f"\nFirst error for {op}: {detail}")
+
+# --- main ------------------------------------------------------------------
+
+async def run(args, stack: LocalStack = None) -> dict:
+    recorder = Recorder()
+    rss_samples = defaultdict(list)
+    sampler = None
+    if stack is not None:
+        sampler = asyncio.create_task(sample_rss(stack.processes, rss_samples))
+    try:
+        gateway_url = stack.gateway_url if stack is not None else args.gateway_url
+        elapsed = await drive_load(args, gateway_url, recorder)
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+    return build_report(recorder, elapsed, rss_samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a request mix through the gateway and report latency/throughput/RSS")
+    parser.add_argument("--rate", type=float, default=5.0, help="Target arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times instead of a fixed interval")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dpi", type=int, default=100, help="DPI for async rasterization jobs")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--job-timeout", type=float, default=120.0, help="Give up on an async job after this many seconds")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--clients", type=int, default=32,
+                        help="Simulated users, each with its own X-Forwarded-For address (the gateway must trust it)")
+    parser.add_argument("--max-inflight", type=int, default=200, help="Client-side cap on concurrent scenarios")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="Wait this long for in-flight scenarios after the run")
+    parser.add_argument("--worker-concurrency", type=int, default=2, help="Celery worker processes")
+    parser.add_argument("--base-port", type=int, default=18000, help="Gateway port; services use the next two")
+    parser.add_argument("--redis-url", help="Use a local Redis broker instead of the filesystem broker")
+    parser.add_argument("--gateway-url", help="Target already running services instead of booting a local stack")
+    parser.add_argument("--workdir", help="Directory for the database, broker, traces and logs (default: temporary)")
+    parser.add_argument("--keep", action="store_true", help="Keep the work directory after the run")
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    stack = None
+    workdir = None
+    if not args.gateway_url:
+        workdir = args.workdir or tempfile.mkdtemp(prefix="easyconvert-load-")
+        os.makedirs(workdir, exist_ok=True)
+        stack = LocalStack(workdir, args.base_port, args.worker_concurrency, args.redis_url)
+        print(f"Starting local stack in {workdir} ...")
+        stack.start()
+
+    try:
+        print(f"Driving {args.rate:g} req/s for {args.duration:g}s with mix {args.mix}")
+        report = asyncio.run(run(args, stack))
+    finally:
+        if stack is not None:
+            stack.stop()
+            if not args.keep and not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                print(f"Logs, traces and database kept in {workdir}")
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import importlib
+import os
+import resource
+import time
+from .metrics import BACKEND_IMPORT_SECONDS, STARTUP_IMPORT_SECONDS, STARTUP_RSS_BYTES
+
+# Heavy libraries are imported on first use rather than at module load, so a process only pays
+# for the ones it needs (pdf2docx pulls in OpenCV and NumPy for /pdf-to-docx alone).
+# Each role preloads its own set at startup; PRELOAD_BACKENDS (comma-separated, empty for none)
+# overrides the default. The Celery worker preloads before forking, so pool children share it.
+ROLE_PRELOADS = {
+    "api": "",
+    "worker": "fitz",
+}
+
+_loaded = {}
+
+def load(name: str):
+    """
+    Imports a backend module once per process, recording how long the import took.
+    """
+    module = _loaded.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - start
+        _loaded[name] = module
+        BACKEND_IMPORT_SECONDS.labels(name).set(elapsed)
+        print(f"PDF-Service: Imported {name} in {elapsed * 1000:.0f}ms (pid {os.getpid()})")
+    return module
+
+class LazyBackend:
+    """
+    Stands in for a backend module and imports it on first attribute access.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(load(self._name), attr)
+
+def rss_bytes() -> int:
+    """
+    Current resident memory of this process (peak RSS where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def preload(role: str, import_seconds: float = None):
+    """
+    Imports the backends configured for `role` and reports import time and RSS for the process.
+    """
+    names = os.getenv("PRELOAD_BACKENDS", ROLE_PRELOADS[role])
+    for name in (n.strip() for n in names.split(",")):
+        if name:
+            load(name)
+    report_startup(role, import_seconds)
+
+def report_startup(role: str, import_seconds: float = None):
+    rss = rss_bytes()
+    STARTUP_RSS_BYTES.labels(role).set(rss)
+    if import_seconds is not None:
+        STARTUP_IMPORT_SECONDS.labels(role).set(import_seconds)
+    imports = f", app imports {import_seconds * 1000:.0f}ms" if import_seconds is not None else ""
+    print(
+        f"PDF-Service: {role} ready (pid {os.getpid()}){imports}, RSS {rss / 2**20:.1f}MB, "
+        f"backends loaded: {', '.join(sorted(_loaded)) or 'none'}"
+    )
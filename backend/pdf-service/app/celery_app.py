@@ -1,12 +1,34 @@
 import os
+import time
+
+# Startup reports how long the modules below (including the tasks) took to import
+_import_started = time.perf_counter()
+
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, task_postrun, worker_init, worker_process_init, worker_ready
+from kombu.exceptions import ChannelError
+from .backends import preload, report_startup
+from .metrics import TASK_RUNTIME, start_metrics_server
+from .tracing import inject_headers, setup_tracing
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_URL)
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", REDIS_URL)
+
+# Folder used by the "filesystem://" broker (local runs without Redis, e.g. the load harness)
+CELERY_FILESYSTEM_DIR = os.getenv("CELERY_FILESYSTEM_DIR", "/tmp/easyconvert-broker")
+
+# Redis redelivers unacknowledged messages after this many seconds; keep it above the longest job,
+# since tasks are acknowledged only once they finish (acks_late)
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "21600"))
+
+# Port for the worker's own /metrics endpoint (disabled when unset)
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT")
 
 celery_app = Celery(
     "pdf_tasks",
-    broker=REDIS_URL,
-    backend=REDIS_URL
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND
 )
 
 celery_app.conf.update(
@@ -15,6 +37,71 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
+    # Long jobs are acknowledged late, so don't let a busy worker hold other messages back
+    worker_prefetch_multiplier=1,
+    broker_transport_options={"visibility_timeout": CELERY_VISIBILITY_TIMEOUT},
 )
 
+if CELERY_BROKER_URL.startswith("filesystem://"):
+    os.makedirs(CELERY_FILESYSTEM_DIR, exist_ok=True)
+    celery_app.conf.broker_transport_options = {
+        "data_folder_in": CELERY_FILESYSTEM_DIR,
+        "data_folder_out": CELERY_FILESYSTEM_DIR,
+        # Exchange tables go here too, instead of a "control" folder in the working directory
+        "control_folder": os.path.join(CELERY_FILESYSTEM_DIR, "control"),
+    }
+
+def get_queue_depth(queue: str = None):
+    """
+    Returns the number of messages waiting in the broker queue, or None if the broker is unreachable.
+    """
+    queue = queue or celery_app.conf.task_default_queue
+    try:
+        with celery_app.connection_for_read() as conn:
+            return conn.default_channel.queue_declare(queue=queue, passive=True).message_count
+    except ChannelError:
+        # Virtual transports (Redis) drop the key once the queue is empty
+        return 0
+    except Exception:
+        return None
+
+@worker_init.connect
+def _setup_worker_tracing(**kwargs):
+    setup_tracing("pdf-worker")
+
+@worker_init.connect
+def _preload_worker_backends(**kwargs):
+    # Runs in the parent before the pool forks, so every child shares the imported backends
+    preload("worker", IMPORT_SECONDS)
+
+@worker_process_init.connect
+def _report_worker_child(**kwargs):
+    report_startup("worker_child")
+
+@before_task_publish.connect
+def _propagate_trace(headers=None, **kwargs):
+    # Custom message headers become attributes of the task request on the worker
+    if headers is not None:
+        inject_headers(headers)
+
+# Task runtime metrics, keyed by task id between prerun and postrun
+_task_started = {}
+
+@task_prerun.connect
+def _record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+@task_postrun.connect
+def _record_task_runtime(task_id=None, task=None, state=None, **kwargs):
+    start = _task_started.pop(task_id, None)
+    if start is not None:
+        TASK_RUNTIME.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
+
+@worker_ready.connect
+def _start_worker_metrics(**kwargs):
+    if WORKER_METRICS_PORT:
+        start_metrics_server(int(WORKER_METRICS_PORT))
+
 import app.tasks
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
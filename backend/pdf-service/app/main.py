@@ -1,41 +1,139 @@
 import io
+import os
+import tempfile
+import time
 import uuid
 import zipfile
-from typing import List, Annotated
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+
+# Startup reports how long the modules below took to import
+_import_started = time.perf_counter()
+
+from typing import List, Annotated, Optional
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
-from .database import get_db, init_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import AsyncSessionLocal, get_db, get_async_db, init_db, get_pool_stats
 from .models import FileStore, ProcessedImages
 from .tasks import convert_pdf_to_images_task
+from .celery_app import get_queue_depth
+from .metrics import MetricsMiddleware, metrics_response, time_stage
+from .tracing import TracingMiddleware, setup_tracing
+from .utils.loop_monitor import loop_monitor
 from .utils.zip_utils import create_zip_from_images, create_zip_from_pdfs
-from .schemas.pdf_schema import AsyncConvertResponse, TaskStatusResponse
+from .utils.raster_utils import MIN_DPI, MAX_DPI
+from pydantic import TypeAdapter, ValidationError
+from .schemas.pdf_schema import AsyncConvertResponse, TaskStatusResponse, PreflightResponse, RenderMode, PipelineOperation, SplitMode, parse_variants
 from .services.pdf_service import (
     insert_image_to_pdf, 
-    split_pdf_service, 
+    insert_images_to_pdf,
+    preflight_pdf,
     add_page_numbers_service, 
     pdf_to_docx_service,
     merge_pdfs_service
 )
+from .services.pipeline_service import run_pipeline
+from .services.split_service import shutdown_pool as shutdown_split_pool, split_pdf_by_mode
+from .backends import preload
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
+setup_tracing("pdf-service")
+
+_pipeline_operations = TypeAdapter(List[PipelineOperation])
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 
 @app.on_event("startup")
 def on_startup():
     init_db()
 
+@app.on_event("startup")
+def preload_backends():
+    # Heavy backends load on first use unless PRELOAD_BACKENDS names them for the API
+    preload("api", IMPORT_SECONDS)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor.stop()
+
+@app.on_event("shutdown")
+def stop_split_pool():
+    shutdown_split_pool()
+
 @app.get("/")
 def read_root():
     return {"message": "PDF Service is running"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return metrics_response()
+
+@app.get("/db-stats")
+def db_stats(reset: bool = False):
+    """
+    Returns DB pool usage and event-loop lag measured since startup (or the last reset).
+    """
+    stats = {"pools": get_pool_stats(), "event_loop": loop_monitor.stats()}
+    if reset:
+        loop_monitor.reset()
+    return stats
+
+@app.get("/queue-stats")
+def queue_stats():
+    """
+    Returns the Celery backlog; polled by the gateway to shed async conversions under overload.
+    """
+    return {"celery_queue_depth": get_queue_depth()}
+
+@app.post("/preflight", response_model=PreflightResponse)
+async def preflight(
+    file: UploadFile = File(...),
+    dpi: Annotated[int, Query(ge=MIN_DPI, le=MAX_DPI)] = 300,
+    render_mode: RenderMode = "capped",
+):
+    """
+    Reports page count, page sizes and the pixels each page would render to, so the cost of a
+    conversion is known before it is queued.
+    """
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+    try:
+        return preflight_pdf(await file.read(), dpi, render_mode)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not read PDF: {str(e)}")
+
 @app.post("/convert-pdf-async", response_model=AsyncConvertResponse)
 async def convert_pdf_async(
     file: UploadFile = File(...), 
-    dpi: int = 300, 
-    db: Session = Depends(get_db)
+    dpi: Annotated[int, Query(ge=MIN_DPI, le=MAX_DPI)] = 300,
+    render_mode: RenderMode = "capped",
+    variants: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """
+    Queues a PDF-to-image conversion. `variants` ("thumb:72:jpeg,screen:150,print:300") renders
+    several resolutions in one job, each page being parsed once; without it one PNG per page is
+    rendered at `dpi`.
+    """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+    variant_list = None
+    if variants:
+        try:
+            variant_list = [variant.model_dump() for variant in parse_variants(variants)]
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Invalid variants: {str(e)}")
     
     # Save the PDF bytes to MySQL FileStore
     file_id = str(uuid.uuid4())
@@ -47,11 +145,12 @@ async def convert_pdf_async(
         file_type=file.content_type,
         status="pending"
     )
-    db.add(new_file)
-    db.commit()
+    with time_stage("convert_pdf_async", "db_write"):
+        db.add(new_file)
+        await db.commit()
     
-    # Trigger the Celery task
-    convert_pdf_to_images_task.delay(file_id, dpi)
+    # Trigger the Celery task (the trace context rides along in the task headers)
+    convert_pdf_to_images_task.delay(file_id, dpi, render_mode, variant_list)
     
     return {"task_id": file_id}
 
@@ -76,51 +175,120 @@ async def insert_image(
     
     try:
         modified_pdf = insert_image_to_pdf(pdf_bytes, image_bytes, split_index)
-        
-        return StreamingResponse(
-            io.BytesIO(modified_pdf),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=modified_{pdf_file.filename}"}
-        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to insert image: {str(e)}")
 
+    return StreamingResponse(
+        io.BytesIO(modified_pdf),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename=modified_{pdf_file.filename}"}
+    )
+
+@app.post("/insert-images")
+async def insert_images(
+    pdf_file: UploadFile = File(...),
+    image_files: List[UploadFile] = File(...),
+    indices: str = "0",
+    fit_modes: str = "fit"
+):
+    """
+    Inserts many images as new pages in one pass.
+    `indices` gives one target index per image ("0, 0, 5"), counted in the original PDF.
+    `fit_modes` is one mode for all images or one per image: fit, fill or stretch.
+    Returns the modified PDF file directly.
+    """
+    if not pdf_file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+    for image_file in image_files:
+        if not any(image_file.filename.lower().endswith(ext) for ext in [".png", ".jpg", ".jpeg"]):
+            raise HTTPException(status_code=400, detail="Only image files (PNG, JPG, JPEG) are allowed")
+
+    try:
+        index_list = [int(index) for index in indices.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="indices must be comma-separated integers")
+    mode_list = [mode.strip().lower() for mode in fit_modes.split(",")]
+    if len(mode_list) == 1:
+        mode_list = mode_list * len(image_files)
+    if len(index_list) != len(image_files) or len(mode_list) != len(image_files):
+        raise HTTPException(status_code=400, detail="Give one index (and one fit mode, or a single one) per image")
+
+    pdf_bytes = await pdf_file.read()
+    insertions = [
+        (await image_file.read(), index, mode)
+        for image_file, index, mode in zip(image_files, index_list, mode_list)
+    ]
+
+    try:
+        modified_pdf = await run_in_threadpool(insert_images_to_pdf, pdf_bytes, insertions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to insert images: {str(e)}")
+
+    return StreamingResponse(
+        io.BytesIO(modified_pdf),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename=modified_{pdf_file.filename}"}
+    )
+
 @app.post("/split-pdf")
 async def split_pdf(
     file: UploadFile = File(...),
-    ranges: str = "1-1"
+    mode: SplitMode = "ranges",
+    ranges: str = "1-1",
+    every_n: Optional[int] = Query(None, ge=1),
+    bookmark_level: int = Query(1, ge=1),
+    max_size_mb: Optional[float] = Query(None, gt=0)
 ):
     """
-    Splits a PDF based on comma-separated ranges.
-    Returns a ZIP containing separate PDF files for each range.
-    Example: "1-3, 5, 8-10"
+    Splits a PDF into parts. Modes:
+    - ranges: comma-separated page ranges, e.g. "1-3, 5, 8-10"
+    - every_n: chunks of every_n pages
+    - bookmarks: one part per outline entry down to bookmark_level
+    - max_size: consecutive pages packed into parts of at most max_size_mb (estimated)
+    Returns the PDF when there is one part, otherwise a ZIP with one PDF per part.
     """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     
     pdf_bytes = await file.read()
+    max_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+    zip_fd, zip_path = tempfile.mkstemp(prefix="split_", suffix=".zip")
+    os.close(zip_fd)
     try:
-        split_results = split_pdf_service(pdf_bytes, ranges)
-        
-        # If only one range was requested, return the PDF directly
-        if len(split_results) == 1:
-            filename, content = split_results[0]
-            return StreamingResponse(
-                io.BytesIO(content),
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-        
-        # If multiple ranges, bundle into a ZIP
-        zip_buffer = create_zip_from_pdfs(split_results)
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=split_{file.filename}.zip"}
+        # Parts are generated off the event loop, in worker processes for large documents
+        single = await run_in_threadpool(
+            split_pdf_by_mode, pdf_bytes, zip_path, mode, ranges, every_n, bookmark_level, max_bytes
         )
+    except ValueError as e:
+        os.remove(zip_path)
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        os.remove(zip_path)
         raise HTTPException(status_code=500, detail=f"Split failed: {str(e)}")
 
+    # If only one part came out, return the PDF directly
+    if single is not None:
+        os.remove(zip_path)
+        filename, content = single
+        return StreamingResponse(
+            io.BytesIO(content),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    # Several parts: the ZIP was written to disk as they completed; remove it once sent
+    return FileResponse(
+        zip_path,
+        media_type="application/zip",
+        filename=f"split_{file.filename}.zip",
+        background=BackgroundTask(os.remove, zip_path)
+    )
+
 @app.post("/add-page-numbers")
 async def add_page_numbers(file: UploadFile = File(...)):
     """
@@ -187,50 +355,128 @@ async def merge_pdfs(files: List[UploadFile] = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Merge failed: {str(e)}")
 
+@app.post("/pipeline")
+async def pipeline(
+    files: List[UploadFile] = File(...),
+    image_files: List[UploadFile] = File(None),
+    operations: str = Form(...)
+):
+    """
+    Runs an ordered list of operations on one in-memory document, so a workflow like
+    "merge, number, split into chapters" parses and saves the PDF only once.
+    `operations` is a JSON list, e.g.
+    [{"op": "merge"}, {"op": "add_page_numbers"}, {"op": "insert_image", "image": 0, "index": 0, "fit_mode": "fill"}, {"op": "split", "ranges": "1-3, 4-9"}]
+    The document starts as the first of `files`; `image_files` are referenced by position.
+    Returns a PDF, or a ZIP when a final split produces several parts.
+    """
+    for file in files:
+        if not file.filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="Only PDF files are allowed")
+
+    image_files = image_files or []
+    for image_file in image_files:
+        if not any(image_file.filename.lower().endswith(ext) for ext in [".png", ".jpg", ".jpeg"]):
+            raise HTTPException(status_code=400, detail="Only image files (PNG, JPG, JPEG) are allowed")
+
+    try:
+        operation_list = _pipeline_operations.validate_json(operations)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid operations: {str(e)}")
+    if not operation_list:
+        raise HTTPException(status_code=422, detail="Give at least one operation")
+
+    pdf_list = [await file.read() for file in files]
+    images = [await image_file.read() for image_file in image_files]
+
+    try:
+        # Parsing, editing and saving are CPU-bound; keep them off the event loop
+        results = await run_in_threadpool(run_pipeline, pdf_list, images, operation_list)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Pipeline failed: {str(e)}")
+
+    if len(results) == 1:
+        filename, content = results[0]
+        return StreamingResponse(
+            io.BytesIO(content),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
+    zip_buffer = create_zip_from_pdfs(results)
+    return StreamingResponse(
+        zip_buffer,
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=pipeline_result.zip"}
+    )
+
 @app.get("/status/{task_id}", response_model=TaskStatusResponse)
 def get_status(task_id: str, db: Session = Depends(get_db)):
     file_record = db.query(FileStore).filter(FileStore.id == task_id).first()
     if not file_record:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return {"status": file_record.status}
+    if file_record.status != "completed":
+        return {"status": file_record.status}
+
+    # Variants still available for download
+    rows = db.query(ProcessedImages.variant).filter(ProcessedImages.parent_file_id == task_id).distinct().all()
+    return {"status": file_record.status, "variants": sorted(row.variant for row in rows)}
 
 @app.get("/download-images/{task_id}")
 async def download_images(
     task_id: str, 
     background_tasks: BackgroundTasks, 
-    db: Session = Depends(get_db)
+    variant: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    file_record = db.query(FileStore).filter(FileStore.id == task_id).first()
-    if not file_record:
+    """
+    Downloads the rendered pages as a ZIP, for one variant or (by default) all of them.
+    Downloaded images are deleted afterwards; the source PDF goes once no images remain.
+    """
+    status = await db.scalar(select(FileStore.status).where(FileStore.id == task_id))
+    if status is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    if file_record.status == "failed":
+    if status == "failed":
         raise HTTPException(status_code=500, detail="The conversion process failed. Check worker logs for details.")
     
-    if file_record.status != "completed":
-        return {"status": file_record.status, "message": "Images are not ready yet. Please check back later."}
+    if status != "completed":
+        return {"status": status, "message": "Images are not ready yet. Please check back later."}
     
-    processed_images = db.query(ProcessedImages).filter(ProcessedImages.parent_file_id == task_id).all()
+    query = select(ProcessedImages).where(ProcessedImages.parent_file_id == task_id)
+    if variant is not None:
+        query = query.where(ProcessedImages.variant == variant)
+    with time_stage("download_images", "db_read"):
+        processed_images = (await db.scalars(query.order_by(ProcessedImages.variant, ProcessedImages.page_number))).all()
     if not processed_images:
         raise HTTPException(status_code=404, detail="No images found for this task")
 
-    # Bundle into ZIP in memory
-    zip_buffer = create_zip_from_images(processed_images)
+    # Bundle into ZIP in memory (one folder per variant when several are downloaded together)
+    by_variant = len({img.variant for img in processed_images}) > 1
+    with time_stage("download_images", "zip"):
+        zip_buffer = await run_in_threadpool(create_zip_from_images, processed_images, by_variant=by_variant)
 
-    # Cleanup logic after sending response
-    def cleanup():
-        # Re-fetch records inside the cleanup to avoid session issues
-        db_cleanup = next(get_db())
-        db_cleanup.query(ProcessedImages).filter(ProcessedImages.parent_file_id == task_id).delete()
-        db_cleanup.query(FileStore).filter(FileStore.id == task_id).delete()
-        db_cleanup.commit()
-        db_cleanup.close()
+    # Cleanup logic after sending response, in its own session as the request's is closed by then
+    async def cleanup():
+        async with AsyncSessionLocal() as db_cleanup:
+            cleanup_query = delete(ProcessedImages).where(ProcessedImages.parent_file_id == task_id)
+            if variant is not None:
+                cleanup_query = cleanup_query.where(ProcessedImages.variant == variant)
+            await db_cleanup.execute(cleanup_query)
+            remaining = await db_cleanup.scalar(
+                select(ProcessedImages.id).where(ProcessedImages.parent_file_id == task_id).limit(1)
+            )
+            if remaining is None:
+                await db_cleanup.execute(delete(FileStore).where(FileStore.id == task_id))
+            await db_cleanup.commit()
 
     background_tasks.add_task(cleanup)
 
+    filename = f"images_{task_id}_{variant}.zip" if variant is not None else f"images_{task_id}.zip"
     return StreamingResponse(
         zip_buffer, 
         media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename=images_{task_id}.zip"}
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
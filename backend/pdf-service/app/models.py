@@ -8,6 +8,7 @@ class FileStore(Base):
     file_data = Column(LargeBinary(length=(2**32)-1))
     file_type = Column(String(50))
     status = Column(String(20), default="pending")
+    attempts = Column(Integer, default=0, server_default="0") # Conversion task deliveries, including redeliveries
 
 class ProcessedImages(Base):
     __tablename__ = "processed_images"
@@ -15,3 +16,5 @@ class ProcessedImages(Base):
     parent_file_id = Column(String(36), ForeignKey("file_store.id"))
     image_data = Column(LargeBinary(length=(2**32)-1))
     page_number = Column(Integer)
+    variant = Column(String(32), default="default", server_default="default") # Named resolution, e.g. "thumb"
+    image_format = Column(String(10), default="png", server_default="png")
@@ -1,7 +1,88 @@
-from pydantic import BaseModel
+from typing import Annotated, List, Literal, Optional, Union
+from pydantic import BaseModel, Field
+from ..utils.raster_utils import MIN_DPI, MAX_DPI, MAX_VARIANTS
+
+# "capped" lowers the dpi of pages above the pixel budget, "tiled" renders them in bands instead
+RenderMode = Literal["capped", "tiled"]
+SplitMode = Literal["ranges", "every_n", "bookmarks", "max_size"]
 
 class TaskStatusResponse(BaseModel):
     status: str
+    variants: Optional[List[str]] = None
+
+class RenderVariant(BaseModel):
+    name: str = Field(pattern=r"^[A-Za-z0-9_-]{1,32}$")
+    dpi: int = Field(ge=MIN_DPI, le=MAX_DPI)
+    image_format: Literal["png", "jpeg"] = "png"
+
+def parse_variants(spec: str) -> List[RenderVariant]:
+    """
+    Parses "thumb:72:jpeg,screen:150,print:300:png" (name:dpi[:format]) into render variants.
+    Raises ValueError on malformed or duplicate entries.
+    """
+    variants = []
+    for item in spec.split(","):
+        parts = [part.strip() for part in item.split(":")]
+        if not item.strip():
+            continue
+        if len(parts) not in (2, 3):
+            raise ValueError(f"Invalid variant '{item.strip()}', expected name:dpi[:format]")
+        fields = {"name": parts[0], "dpi": parts[1]}
+        if len(parts) == 3:
+            fields["image_format"] = "jpeg" if parts[2].lower() == "jpg" else parts[2].lower()
+        variants.append(RenderVariant(**fields))
+    if not variants:
+        raise ValueError("No variants given")
+    if len(variants) > MAX_VARIANTS:
+        raise ValueError(f"At most {MAX_VARIANTS} variants are allowed")
+    if len({variant.name for variant in variants}) != len(variants):
+        raise ValueError("Variant names must be unique")
+    return variants
 
 class AsyncConvertResponse(BaseModel):
     task_id: str
+
+class PagePreflight(BaseModel):
+    page_number: int
+    width_pt: float
+    height_pt: float
+    requested_pixels: int
+    effective_dpi: int
+    pixels: int
+    tiled: bool
+
+class PreflightResponse(BaseModel):
+    page_count: int
+    dpi: int
+    render_mode: RenderMode
+    max_page_pixels: int
+    total_pixels: int
+    capped_pages: int
+    pages: List[PagePreflight]
+
+# Pipeline operations, applied in order to one in-memory document
+class MergeOperation(BaseModel):
+    op: Literal["merge"]
+    files: Optional[List[int]] = None # Upload positions to append; default: every PDF after the first
+
+class AddPageNumbersOperation(BaseModel):
+    op: Literal["add_page_numbers"]
+
+class InsertImageOperation(BaseModel):
+    op: Literal["insert_image"]
+    image: int = 0 # Position in image_files
+    index: int = 0 # Page index in the document at this step
+    fit_mode: Literal["fit", "fill", "stretch"] = "fit"
+
+class SplitOperation(BaseModel):
+    op: Literal["split"]
+    mode: SplitMode = "ranges"
+    ranges: Optional[str] = None
+    every_n: Optional[int] = Field(None, ge=1)
+    bookmark_level: int = Field(1, ge=1)
+    max_size_mb: Optional[float] = Field(None, gt=0)
+
+PipelineOperation = Annotated[
+    Union[MergeOperation, AddPageNumbersOperation, InsertImageOperation, SplitOperation],
+    Field(discriminator="op"),
+]
@@ -1,109 +1,276 @@
-import fitz
+from __future__ import annotations
+import hashlib
 import uuid
 import io
 import os
 import tempfile
-from pdf2docx import Converter
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from ..models import FileStore, ProcessedImages
+from ..metrics import time_stage
+from ..tracing import tracer
+from ..backends import LazyBackend
+from ..utils.raster_utils import JPEG_QUALITY, MAX_PAGE_PIXELS, page_pixels, plan_page, render_tiled_png
+
+fitz = LazyBackend("fitz")
+pdf2docx = LazyBackend("pdf2docx")
+
+DEFAULT_VARIANT = "default"
+
+def _render_variant(page: fitz.Page, display_list: fitz.DisplayList, variant: dict, render_mode: str) -> bytes:
+    """
+    Rasterizes one variant of a page from its display list, within the pixel budget.
+    Tiled rendering streams PNG only, so other formats are always dpi-capped.
+    """
+    image_format = variant.get("image_format", "png")
+    page_dpi, tiled = plan_page(page.rect, variant["dpi"], render_mode if image_format == "png" else "capped")
+    with tracer.start_as_current_span("pdf_conversion.variant") as span:
+        span.set_attribute("easyconvert.variant", variant["name"])
+        span.set_attribute("easyconvert.effective_dpi", page_dpi)
+        span.set_attribute("easyconvert.tiled", tiled)
+        if tiled:
+            return render_tiled_png(page, page_dpi, display_list)
+        with time_stage("pdf_conversion", "render"):
+            pix = display_list.get_pixmap(matrix=fitz.Matrix(page_dpi / 72, page_dpi / 72), alpha=False)
+        with time_stage("pdf_conversion", "encode"):
+            if image_format == "jpeg":
+                return pix.tobytes("jpg", jpg_quality=JPEG_QUALITY)
+            return pix.tobytes("png")
+
+def _image_id(file_id: str, variant: str, page_number: int) -> str:
+    # Deterministic, so a re-rendered page overwrites its earlier row instead of duplicating it
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"easyconvert:{file_id}:{variant}:{page_number}"))
+
+def process_pdf_conversion(file_id: str, dpi: int, db: Session, render_mode: str = "capped", variants: list[dict] = None):
+    """
+    Rasterizes every page of a stored PDF. Each page is parsed into a display list once and
+    rendered at every requested variant (name, dpi, image_format); without variants a single
+    "default" PNG at dpi is produced.
+    Pages are committed one at a time and act as checkpoints: a retried or redelivered job
+    only renders the pages (and variants) that are not stored yet.
+    """
+    variants = variants or [{"name": DEFAULT_VARIANT, "dpi": dpi, "image_format": "png"}]
 
-def process_pdf_conversion(file_id: str, dpi: int, db: Session):
     # Fetch the PDF
     file_record = db.query(FileStore).filter(FileStore.id == file_id).first()
     if not file_record:
         return f"Error: File {file_id} not found"
+    if file_record.status == "completed":
+        # Duplicate delivery of a job that already finished
+        return f"File {file_id} already processed"
+
+    # Pages committed by an earlier, interrupted run of this job
+    done = {
+        (row.page_number, row.variant)
+        for row in db.query(ProcessedImages.page_number, ProcessedImages.variant).filter(ProcessedImages.parent_file_id == file_id)
+    }
 
     # Update status to processing
     file_record.status = "processing"
     db.commit()
 
     # Open PDF with PyMuPDF
-    pdf_document = fitz.open(stream=file_record.file_data, filetype="pdf")
+    with time_stage("pdf_conversion", "decode"):
+        pdf_document = fitz.open(stream=file_record.file_data, filetype="pdf")
     
     try:
         total_pages = len(pdf_document)
+        skipped_pages = 0
         for page_num in range(total_pages):
-            page = pdf_document.load_page(page_num)
-            pix = page.get_pixmap(dpi=dpi)
-            image_bytes = pix.tobytes("png")
-
-            # Save each image to ProcessedImages
-            processed_image = ProcessedImages(
-                id=str(uuid.uuid4()),
-                parent_file_id=file_id,
-                image_data=image_bytes,
-                page_number=page_num + 1
-            )
-            db.add(processed_image)
-            db.commit()
+            todo = [variant for variant in variants if (page_num + 1, variant["name"]) not in done]
+            if not todo:
+                skipped_pages += 1
+                continue
+
+            with tracer.start_as_current_span("pdf_conversion.page") as span:
+                span.set_attribute("easyconvert.page_number", page_num + 1)
+                with time_stage("pdf_conversion", "decode"):
+                    page = pdf_document.load_page(page_num)
+                    display_list = page.get_displaylist()
+
+                image_bytes_total = 0
+                for variant in todo:
+                    image_bytes = _render_variant(page, display_list, variant, render_mode)
+                    image_bytes_total += len(image_bytes)
+
+                    # Save each image to ProcessedImages (merge makes the write idempotent)
+                    processed_image = ProcessedImages(
+                        id=_image_id(file_id, variant["name"], page_num + 1),
+                        parent_file_id=file_id,
+                        image_data=image_bytes,
+                        page_number=page_num + 1,
+                        variant=variant["name"],
+                        image_format=variant.get("image_format", "png"),
+                    )
+                    db.merge(processed_image)
+                display_list = None
+                span.set_attribute("easyconvert.image_bytes", image_bytes_total)
+
+                # One commit per page covers all of its variants and is the checkpoint
+                with time_stage("pdf_conversion", "db_write"):
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        # A concurrent delivery of the same job stored this page first
+                        db.rollback()
 
         # Update status to completed
         file_record.status = "completed"
         db.commit()
         
+        if skipped_pages:
+            return f"Successfully processed {total_pages} pages for {file_id} ({skipped_pages} resumed from checkpoint)"
         return f"Successfully processed {total_pages} pages for {file_id}"
     finally:
         pdf_document.close()
 
-def insert_image_to_pdf(pdf_bytes: bytes, image_bytes: bytes, split_index: int) -> bytes:
+def preflight_pdf(pdf_bytes: bytes, dpi: int, render_mode: str = "capped") -> dict:
     """
-    Inserts an image into a PDF as a new page at the given split_index.
-    If split_index is 0, it's inserted at the very beginning.
-    The new page size will match the existing pages.
+    Reports page count, page sizes and the pixels each page would render to, without rendering anything.
     """
-    pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-    image_stream = fitz.open(stream=image_bytes, filetype="png") if image_bytes.startswith(b"\x89PNG") else fitz.open(stream=image_bytes)
-    
+    with time_stage("preflight", "open"):
+        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
     try:
-        # Get the size of the first page to match (or use default if empty)
-        if len(pdf_document) > 0:
-            rect = pdf_document[0].rect
+        pages = []
+        for page_num in range(len(pdf_document)):
+            rect = pdf_document.load_page(page_num).rect
+            page_dpi, tiled = plan_page(rect, dpi, render_mode)
+            pages.append({
+                "page_number": page_num + 1,
+                "width_pt": round(rect.width, 2),
+                "height_pt": round(rect.height, 2),
+                "requested_pixels": page_pixels(rect, dpi),
+                "effective_dpi": page_dpi,
+                "pixels": page_pixels(rect, page_dpi),
+                "tiled": tiled,
+            })
+        return {
+            "page_count": len(pages),
+            "dpi": dpi,
+            "render_mode": render_mode,
+            "max_page_pixels": MAX_PAGE_PIXELS,
+            "total_pixels": sum(page["pixels"] for page in pages),
+            "capped_pages": sum(1 for page in pages if page["effective_dpi"] < dpi),
+            "pages": pages,
+        }
+    finally:
+        pdf_document.close()
+
+FIT_MODES = ("fit", "fill", "stretch")
+
+def _image_rect(page_rect: fitz.Rect, image_size: fitz.Rect, fit_mode: str) -> fitz.Rect:
+    """
+    Returns where an image goes on a page: "fit" keeps the aspect ratio inside the page,
+    "fill" keeps it while covering the whole page (overflow is cropped by the page), "stretch" ignores it.
+    """
+    if fit_mode == "stretch":
+        return page_rect
+    scale_x = page_rect.width / image_size.width
+    scale_y = page_rect.height / image_size.height
+    scale = max(scale_x, scale_y) if fit_mode == "fill" else min(scale_x, scale_y)
+    width, height = image_size.width * scale, image_size.height * scale
+    x0 = page_rect.x0 + (page_rect.width - width) / 2
+    y0 = page_rect.y0 + (page_rect.height - height) / 2
+    return fitz.Rect(x0, y0, x0 + width, y0 + height)
+
+def save_document(doc: fitz.Document) -> bytes:
+    output_buffer = io.BytesIO()
+    doc.save(output_buffer)
+    return output_buffer.getvalue()
+
+def insert_images_into_document(doc: fitz.Document, insertions: list[tuple[bytes, int, str]], embedded: dict = None):
+    """
+    Inserts images as new pages of an open document.
+    Each insertion is (image_bytes, index, fit_mode); indices refer to the document as passed in
+    (0 = before the first page, page count or -1 = append), and images sharing an index keep their order.
+    Identical images are embedded once; pass the same `embedded` dict to reuse them across calls.
+    New pages match the size of the first page.
+    """
+    page_count = len(doc)
+    # -1 appends, as with new_page(pno=-1)
+    insertions = [(image_bytes, page_count if index == -1 else index, fit_mode) for image_bytes, index, fit_mode in insertions]
+    for image_bytes, index, fit_mode in insertions:
+        if not 0 <= index <= page_count:
+            raise ValueError(f"Index {index} is out of range for a {page_count}-page PDF")
+        if fit_mode not in FIT_MODES:
+            raise ValueError(f"Unknown fit mode '{fit_mode}', expected one of {', '.join(FIT_MODES)}")
+
+    # Get the size of the first page to match (or use default if empty)
+    rect = doc[0].rect if page_count > 0 else fitz.PaperRect("a4")
+
+    # Image size (from the header only) and xref of each distinct image, keyed by its hash
+    embedded = {} if embedded is None else embedded
+    # Insert from the highest index down, so lower indices still point at the original pages.
+    # The sort is stable, so walking it backwards also keeps images that share an index in their given order
+    for image_bytes, index, fit_mode in reversed(sorted(insertions, key=lambda insertion: insertion[1])):
+        key = hashlib.sha256(image_bytes).digest()
+        if key not in embedded:
+            with fitz.open(stream=image_bytes) as image_document:
+                embedded[key] = {"size": image_document[0].rect, "xref": None}
+        image = embedded[key]
+        new_page = doc.new_page(pno=index, width=rect.width, height=rect.height)
+        target = _image_rect(new_page.rect, image["size"], fit_mode)
+        if image["xref"] is not None:
+            new_page.insert_image(target, xref=image["xref"], keep_proportion=False)
         else:
-            rect = fitz.PaperRect("a4")
+            image["xref"] = new_page.insert_image(target, stream=image_bytes, keep_proportion=False)
+
+def insert_images_to_pdf(pdf_bytes: bytes, insertions: list[tuple[bytes, int, str]]) -> bytes:
+    """
+    Inserts many images as new pages in one open/save (see insert_images_into_document).
+    """
+    with time_stage("insert_image", "open"):
+        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        with time_stage("insert_image", "insert"):
+            insert_images_into_document(pdf_document, insertions)
 
-        # Create a new blank page at the specified index
-        # PyMuPDF indices are 0-based. split_index=0 means insert at 0.
-        new_page = pdf_document.new_page(pno=split_index, width=rect.width, height=rect.height)
-        
-        # Insert the image into the new page
-        # We'll center the image or fit it to the page
-        new_page.insert_image(rect, stream=image_bytes)
-        
         # Save the modified PDF to a buffer
-        output_buffer = io.BytesIO()
-        pdf_document.save(output_buffer)
-        return output_buffer.getvalue()
+        with time_stage("insert_image", "save"):
+            return save_document(pdf_document)
     finally:
         pdf_document.close()
-        image_stream.close()
 
-def split_pdf_service(pdf_bytes: bytes, ranges: str) -> list[tuple[str, bytes]]:
+def insert_image_to_pdf(pdf_bytes: bytes, image_bytes: bytes, split_index: int) -> bytes:
     """
-    Splits a PDF based on provided ranges (e.g., "1-3, 5, 7-10").
-    Returns a list of tuples containing (filename, pdf_bytes) for each range.
+    Inserts an image into a PDF as a new page at the given split_index.
+    If split_index is 0, it's inserted at the very beginning.
+    The new page size will match the existing pages.
+    """
+    return insert_images_to_pdf(pdf_bytes, [(image_bytes, split_index, "fit")])
+
+def parse_ranges(ranges: str) -> list[tuple[str, int, int]]:
+    """
+    Parses ranges like "1-3, 5, 7-10" (1-based) into (filename, first_page, last_page) with 0-based pages.
+    """
+    parts = []
+    for group in (r.strip() for r in ranges.split(",")):
+        if "-" in group:
+            start, end = map(int, group.split("-"))
+            parts.append((f"pages_{start}_to_{end}.pdf", start - 1, end - 1))
+        else:
+            page_num = int(group)
+            parts.append((f"page_{page_num}.pdf", page_num - 1, page_num - 1))
+    return parts
+
+def extract_pages(src_doc: fitz.Document, first_page: int, last_page: int) -> fitz.Document:
+    new_doc = fitz.open()
+    new_doc.insert_pdf(src_doc, from_page=first_page, to_page=last_page)
+    return new_doc
+
+def split_document(src_doc: fitz.Document, parts: list[tuple[str, int, int]]) -> list[tuple[str, bytes]]:
+    """
+    Splits an open document into parts given as (filename, first_page, last_page), saving each part.
+    Returns a list of tuples containing (filename, pdf_bytes) for each part.
     """
-    src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     results = []
-    try:
-        page_groups = [r.strip() for r in ranges.split(",")]
-        for group in page_groups:
-            new_doc = fitz.open()
-            if "-" in group:
-                start, end = map(int, group.split("-"))
-                new_doc.insert_pdf(src_doc, from_page=start-1, to_page=end-1)
-                filename = f"pages_{start}_to_{end}.pdf"
-            else:
-                page_num = int(group)
-                new_doc.insert_pdf(src_doc, from_page=page_num-1, to_page=page_num-1)
-                filename = f"page_{page_num}.pdf"
-            
-            output_buffer = io.BytesIO()
-            new_doc.save(output_buffer)
-            results.append((filename, output_buffer.getvalue()))
-            new_doc.close()
-        return results
-    finally:
-        src_doc.close()
+    for filename, first_page, last_page in parts:
+        with time_stage("split_pdf", "insert"):
+            new_doc = extract_pages(src_doc, first_page, last_page)
+        with time_stage("split_pdf", "save"):
+            results.append((filename, save_document(new_doc)))
+        new_doc.close()
+    return results
 
 def merge_pdfs_service(pdf_list: list[bytes]) -> bytes:
     """
@@ -113,34 +280,42 @@ def merge_pdfs_service(pdf_list: list[bytes]) -> bytes:
     merged_doc = fitz.open()
     try:
         for pdf_bytes in pdf_list:
-            src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            merged_doc.insert_pdf(src_doc)
+            with time_stage("merge_pdfs", "open"):
+                src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            with time_stage("merge_pdfs", "insert"):
+                merged_doc.insert_pdf(src_doc)
             src_doc.close()
         
-        output_buffer = io.BytesIO()
-        merged_doc.save(output_buffer)
-        return output_buffer.getvalue()
+        with time_stage("merge_pdfs", "save"):
+            return save_document(merged_doc)
     finally:
         merged_doc.close()
 
+def add_page_numbers_to_document(doc: fitz.Document):
+    """
+    Adds "Page X of Y" labels to the bottom right of each page of an open document.
+    """
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        text = f"Page {page_num + 1} of {len(doc)}"
+        # Position: bottom right
+        # Calculate coordinates based on page size
+        rect = page.rect
+        point = fitz.Point(rect.width - 100, rect.height - 30)
+        page.insert_text(point, text, fontsize=10, color=(0, 0, 0))
+
 def add_page_numbers_service(pdf_bytes: bytes) -> bytes:
     """
     Adds page numbers to the bottom right of each page.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    with time_stage("add_page_numbers", "open"):
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
     try:
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = f"Page {page_num + 1} of {len(doc)}"
-            # Position: bottom right
-            # Calculate coordinates based on page size
-            rect = page.rect
-            point = fitz.Point(rect.width - 100, rect.height - 30)
-            page.insert_text(point, text, fontsize=10, color=(0, 0, 0))
+        with time_stage("add_page_numbers", "insert"):
+            add_page_numbers_to_document(doc)
             
-        output_buffer = io.BytesIO()
-        doc.save(output_buffer)
-        return output_buffer.getvalue()
+        with time_stage("add_page_numbers", "save"):
+            return save_document(doc)
     finally:
         doc.close()
 
@@ -158,8 +333,10 @@ def pdf_to_docx_service(pdf_bytes: bytes) -> bytes:
     
     try:
         # Convert PDF to DOCX
-        cv = Converter(temp_pdf_path)
-        cv.convert(temp_docx_path, start=0, end=None)
+        with time_stage("pdf_to_docx", "open"):
+            cv = pdf2docx.Converter(temp_pdf_path)
+        with time_stage("pdf_to_docx", "convert"):
+            cv.convert(temp_docx_path, start=0, end=None)
         cv.close()
         
         # Read the DOCX bytes
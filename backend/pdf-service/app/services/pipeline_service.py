@@ -0,0 +1,59 @@
+from ..backends import LazyBackend
+from ..metrics import time_stage
+from ..schemas.pdf_schema import (
+    AddPageNumbersOperation,
+    InsertImageOperation,
+    MergeOperation,
+    PipelineOperation,
+    SplitOperation,
+)
+from .pdf_service import (
+    add_page_numbers_to_document,
+    insert_images_into_document,
+    save_document,
+    split_document,
+)
+from .split_service import plan_split
+
+fitz = LazyBackend("fitz")
+
+def run_pipeline(pdf_list: list[bytes], images: list[bytes], operations: list[PipelineOperation]) -> list[tuple[str, bytes]]:
+    """
+    Runs operations in order on one in-memory document, starting from the first PDF.
+    The document is parsed once and saved once at the end, or once per part when the last
+    operation is a split. Returns a list of (filename, pdf_bytes).
+    """
+    for position, operation in enumerate(operations):
+        if isinstance(operation, SplitOperation) and position != len(operations) - 1:
+            raise ValueError("split must be the last operation")
+
+    with time_stage("pipeline", "open"):
+        doc = fitz.open(stream=pdf_list[0], filetype="pdf")
+    try:
+        # Images inserted more than once are embedded once for the whole pipeline
+        embedded = {}
+        for operation in operations:
+            with time_stage("pipeline", operation.op):
+                if isinstance(operation, MergeOperation):
+                    positions = operation.files if operation.files is not None else range(1, len(pdf_list))
+                    for position in positions:
+                        if not 0 <= position < len(pdf_list):
+                            raise ValueError(f"merge: no uploaded PDF at position {position}")
+                        with fitz.open(stream=pdf_list[position], filetype="pdf") as src_doc:
+                            doc.insert_pdf(src_doc)
+                elif isinstance(operation, AddPageNumbersOperation):
+                    add_page_numbers_to_document(doc)
+                elif isinstance(operation, InsertImageOperation):
+                    if not 0 <= operation.image < len(images):
+                        raise ValueError(f"insert_image: no uploaded image at position {operation.image}")
+                    insert_images_into_document(doc, [(images[operation.image], operation.index, operation.fit_mode)], embedded)
+                elif isinstance(operation, SplitOperation):
+                    max_bytes = int(operation.max_size_mb * 1024 * 1024) if operation.max_size_mb else None
+                    parts = plan_split(doc, operation.mode, operation.ranges, operation.every_n,
+                                       operation.bookmark_level, max_bytes)
+                    return split_document(doc, parts)
+
+        with time_stage("pipeline", "save"):
+            return [("pipeline_result.pdf", save_document(doc))]
+    finally:
+        doc.close()
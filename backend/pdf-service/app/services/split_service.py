@@ -0,0 +1,256 @@
+from __future__ import annotations
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from ..backends import LazyBackend
+from ..metrics import time_stage
+from .pdf_service import extract_pages, parse_ranges, split_document
+
+fitz = LazyBackend("fitz")
+
+# Worker processes generating split parts, shared by all requests of this process
+SPLIT_WORKERS = int(os.getenv("SPLIT_WORKERS", str(os.cpu_count() or 1)))
+# Smaller documents are split in-process, where starting workers would cost more than it saves
+SPLIT_PARALLEL_MIN_PAGES = int(os.getenv("SPLIT_PARALLEL_MIN_PAGES", "200"))
+
+# Bytes each object adds besides its body: "N 0 obj ... endobj" framing and its xref table entry
+_OBJECT_OVERHEAD = 50
+_REFERENCE = re.compile(rb"(\d+) 0 R")
+_PARENT = re.compile(rb"/Parent \d+ 0 R")
+
+def _slug(title: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", title).strip("_")
+    return slug[:60] or "section"
+
+def _plan_every_n(page_count: int, every_n: int) -> list[tuple[str, int, int]]:
+    return [
+        (f"pages_{start + 1}_to_{min(start + every_n, page_count)}.pdf", start, min(start + every_n, page_count) - 1)
+        for start in range(0, page_count, every_n)
+    ]
+
+def _plan_bookmarks(doc: fitz.Document, level: int) -> list[tuple[str, int, int]]:
+    """
+    One part per outline entry at or above `level`, running until the next such entry.
+    Pages before the first entry become a "front_matter" part.
+    """
+    starts = {}
+    for entry_level, title, page in doc.get_toc(simple=True):
+        # Entries pointing nowhere (page -1) or at a page already taken don't start a part
+        if entry_level <= level and 1 <= page <= doc.page_count and page - 1 not in starts:
+            starts[page - 1] = title
+    if not starts:
+        raise ValueError(f"The PDF has no bookmarks at level {level} or above")
+
+    first_pages = sorted(starts)
+    parts = []
+    if first_pages[0] > 0:
+        parts.append(("00_front_matter.pdf", 0, first_pages[0] - 1))
+    for i, first_page in enumerate(first_pages):
+        last_page = first_pages[i + 1] - 1 if i + 1 < len(first_pages) else doc.page_count - 1
+        parts.append((f"{i + 1:02d}_{_slug(starts[first_page])}.pdf", first_page, last_page))
+    return parts
+
+def _page_objects(doc: fitz.Document, page_number: int, sizes: dict) -> dict:
+    """
+    Returns {xref: estimated bytes} for every object a page pulls into a copy of it
+    (content streams, resources, fonts, images), without following /Parent up the page tree.
+    """
+    found = {}
+    pending = [doc[page_number].xref]
+    while pending:
+        xref = pending.pop()
+        if xref in found:
+            continue
+        if xref not in sizes:
+            source = doc.xref_object(xref, compressed=True).encode("latin-1", "replace")
+            size = len(source) + _OBJECT_OVERHEAD
+            if doc.xref_is_stream(xref):
+                kind, value = doc.xref_get_key(xref, "Length")
+                if kind == "int":
+                    size += int(value)
+                elif kind == "xref":
+                    size += int(doc.xref_object(int(value.split()[0])) or 0)
+            references = [int(x) for x in _REFERENCE.findall(_PARENT.sub(b"", source))]
+            sizes[xref] = (size, references)
+        size, references = sizes[xref]
+        found[xref] = size
+        pending.extend(r for r in references if 0 < r < doc.xref_length())
+    return found
+
+def _plan_max_size(doc: fitz.Document, max_bytes: int) -> list[tuple[str, int, int]]:
+    """
+    Packs consecutive pages into parts whose estimated size stays under max_bytes.
+    Objects shared by several pages (fonts, logos) are counted once per part, as they are
+    stored once in it. A single page over the limit still becomes a part of its own.
+    """
+    sizes = {}
+    parts = []
+    first_page = 0
+    part_objects = {}
+    part_bytes = 0
+    for page_number in range(doc.page_count):
+        objects = _page_objects(doc, page_number, sizes)
+        added = sum(size for xref, size in objects.items() if xref not in part_objects)
+        if part_objects and part_bytes + added > max_bytes:
+            parts.append((first_page, page_number - 1))
+            first_page, part_objects, part_bytes = page_number, {}, 0
+            added = sum(objects.values())
+        part_objects.update(objects)
+        part_bytes += added
+    parts.append((first_page, doc.page_count - 1))
+    return [(f"part_{i + 1:03d}_pages_{s + 1}_to_{e + 1}.pdf", s, e) for i, (s, e) in enumerate(parts)]
+
+def plan_split(doc: fitz.Document, mode: str, ranges: str = None, every_n: int = None,
+               bookmark_level: int = 1, max_bytes: int = None) -> list[tuple[str, int, int]]:
+    """
+    Works out the parts of a split as (filename, first_page, last_page) with 0-based pages.
+    Raises ValueError for a missing or unusable parameter.
+    """
+    with time_stage("split_pdf", "plan"):
+        if mode == "ranges":
+            if not ranges:
+                raise ValueError("ranges is required for mode=ranges")
+            try:
+                parts = parse_ranges(ranges)
+            except ValueError:
+                raise ValueError(f"Invalid ranges: {ranges}")
+        elif mode == "every_n":
+            if not every_n or every_n < 1:
+                raise ValueError("every_n must be a positive page count for mode=every_n")
+            parts = _plan_every_n(doc.page_count, every_n)
+        elif mode == "bookmarks":
+            parts = _plan_bookmarks(doc, bookmark_level)
+        elif mode == "max_size":
+            if not max_bytes or max_bytes <= 0:
+                raise ValueError("max_size_mb must be positive for mode=max_size")
+            parts = _plan_max_size(doc, max_bytes)
+        else:
+            raise ValueError(f"Unknown split mode: {mode}")
+
+    for filename, first_page, last_page in parts:
+        if not 0 <= first_page <= last_page < doc.page_count:
+            raise ValueError(f"{filename}: pages out of range for a {doc.page_count}-page document")
+    return parts
+
+# Source document of a worker process. It stays open while the worker writes parts of the same
+# split and is swapped when a part of another split arrives, so a worker holds one source at a time
+_source_path = None
+_source_doc = None
+
+def _write_part(src_doc: fitz.Document, position: int, filename: str, first_page: int, last_page: int, out_dir: str) -> tuple[str, str]:
+    part_doc = extract_pages(src_doc, first_page, last_page)
+    path = os.path.join(out_dir, f"part_{position}.pdf")
+    part_doc.save(path, garbage=3, deflate=True)
+    part_doc.close()
+    return filename, path
+
+def _write_part_in_worker(source_path: str, *args) -> tuple[str, str]:
+    global _source_path, _source_doc
+    if source_path != _source_path:
+        if _source_doc is not None:
+            _source_doc.close()
+        _source_doc = fitz.open(source_path)
+        _source_path = source_path
+    return _write_part(_source_doc, *args)
+
+def _pool_context():
+    # forkserver gives workers a clean process (no inherited threads or DB connections)
+    # while this module and PyMuPDF are imported once in the server instead of in every worker
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__, "fitz"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+# One pool for the whole process: concurrent splits queue their parts on the same SPLIT_WORKERS
+# processes instead of each starting its own, which caps split processes (and source copies) per replica
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(SPLIT_WORKERS, mp_context=_pool_context())
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    # A worker died (e.g. killed for memory); start a fresh pool for the next split
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+def write_split_zip(pdf_bytes: bytes, parts: list[tuple[str, int, int]], zip_path: str, page_count: int):
+    """
+    Generates the parts and writes them into a ZIP at zip_path as each one completes.
+    Large documents are split on the shared pool of SPLIT_WORKERS processes; parts are kept on disk,
+    so memory holds at most one source copy per worker rather than every part.
+    """
+    with tempfile.TemporaryDirectory(prefix="split_") as work_dir, \
+            zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+        # PDFs are already compressed; storing them keeps the archive step cheap
+        def add(filename: str, path: str):
+            with time_stage("split_pdf", "zip"):
+                archive.write(path, filename)
+            os.remove(path)
+
+        if SPLIT_WORKERS > 1 and len(parts) > 1 and page_count >= SPLIT_PARALLEL_MIN_PAGES:
+            source_path = os.path.join(work_dir, "source.pdf")
+            with open(source_path, "wb") as f:
+                f.write(pdf_bytes)
+            pool = _get_pool()
+            futures = [pool.submit(_write_part_in_worker, source_path, i, *part, work_dir) for i, part in enumerate(parts)]
+            try:
+                with time_stage("split_pdf", "parts"):
+                    for future in as_completed(futures):
+                        add(*future.result())
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                raise
+            finally:
+                # Don't leave this split's remaining parts queued ahead of other requests
+                for future in futures:
+                    future.cancel()
+            return
+
+        with time_stage("split_pdf", "open"):
+            src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            for i, part in enumerate(parts):
+                with time_stage("split_pdf", "parts"):
+                    filename, path = _write_part(src_doc, i, *part, work_dir)
+                add(filename, path)
+        finally:
+            src_doc.close()
+
+def split_pdf_by_mode(pdf_bytes: bytes, zip_path: str, mode: str, ranges: str = None, every_n: int = None,
+                      bookmark_level: int = 1, max_bytes: int = None):
+    """
+    Plans a split and generates its parts. A single part is returned as (filename, pdf_bytes);
+    several parts are written to a ZIP at zip_path and None is returned.
+    """
+    with time_stage("split_pdf", "open"):
+        src_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        parts = plan_split(src_doc, mode, ranges, every_n, bookmark_level, max_bytes)
+        page_count = src_doc.page_count
+        if len(parts) == 1:
+            return split_document(src_doc, parts)[0]
+    finally:
+        src_doc.close()
+    write_split_zip(pdf_bytes, parts, zip_path, page_count)
+    return None
@@ -1,29 +1,88 @@
 import logging
+import os
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from .celery_app import celery_app
 from .database import SessionLocal
 from .services.pdf_service import process_pdf_conversion
 from .models import FileStore
+from .tracing import extract_task_context, tracer
+from opentelemetry.trace import SpanKind
 
 logger = logging.getLogger(__name__)
 
-@celery_app.task(name="app.tasks.convert_pdf_to_images_task")
-def convert_pdf_to_images_task(file_id: str, dpi: int):
+# Total runs of one conversion (first try, retries and redeliveries after a worker was lost)
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+TASK_RETRY_BACKOFF_MAX = int(os.getenv("TASK_RETRY_BACKOFF_MAX", "600")) # Seconds
+
+# Transient failures worth retrying; anything else (e.g. a corrupt PDF) fails the job right away
+RETRYABLE_ERRORS = (OperationalError, PoolTimeoutError)
+
+def _mark_failed(db, file_id: str):
+    db.rollback()
+    file_record = db.query(FileStore).filter(FileStore.id == file_id).first()
+    if file_record:
+        file_record.status = "failed"
+        db.commit()
+
+@celery_app.task(
+    bind=True,
+    name="app.tasks.convert_pdf_to_images_task",
+    # Acknowledge only after the job finishes, and requeue it if the worker process dies,
+    # so a crash resumes from the last committed page instead of losing the job
+    acks_late=True,
+    reject_on_worker_lost=True,
+    autoretry_for=RETRYABLE_ERRORS,
+    max_retries=TASK_MAX_ATTEMPTS - 1,
+    retry_backoff=True,
+    retry_backoff_max=TASK_RETRY_BACKOFF_MAX,
+    retry_jitter=True,
+)
+def convert_pdf_to_images_task(self, file_id: str, dpi: int, render_mode: str = "capped", variants: list = None):
     """
     Celery task wrapper for PDF conversion.
-    Handles session management and high-level error reporting.
+    Handles session management, retries and high-level error reporting.
     """
-    db = SessionLocal()
-    try:
-        result = process_pdf_conversion(file_id, dpi, db)
-        return result
-    except Exception as e:
-        logger.error(f"Task failed for file {file_id}: {str(e)}")
-        # Ensure status is updated to failed on critical errors
-        file_record = db.query(FileStore).filter(FileStore.id == file_id).first()
-        if file_record:
-            file_record.status = "failed"
-            db.commit()
-        return f"Error: {str(e)}"
-    finally:
-        db.close()
+    # Continue the trace started by the request that queued this task
+    with tracer.start_as_current_span(
+        "convert_pdf_to_images_task",
+        context=extract_task_context(self.request),
+        kind=SpanKind.CONSUMER,
+    ) as span:
+        span.set_attribute("easyconvert.file_id", file_id)
+        span.set_attribute("easyconvert.dpi", dpi)
+        span.set_attribute("easyconvert.render_mode", render_mode)
+        span.set_attribute("easyconvert.retries", self.request.retries)
+        if variants:
+            span.set_attribute("easyconvert.variants", [v["name"] for v in variants])
+        db = SessionLocal()
+        try:
+            # Count every run, so a PDF that keeps killing the worker is eventually given up on
+            file_record = db.query(FileStore).filter(FileStore.id == file_id).first()
+            if file_record:
+                file_record.attempts = (file_record.attempts or 0) + 1
+                db.commit()
+                span.set_attribute("easyconvert.attempt", file_record.attempts)
+                if file_record.attempts > TASK_MAX_ATTEMPTS and file_record.status != "completed":
+                    logger.error(f"Giving up on file {file_id} after {TASK_MAX_ATTEMPTS} attempts")
+                    _mark_failed(db, file_id)
+                    return f"Error: Gave up after {TASK_MAX_ATTEMPTS} attempts"
 
+            result = process_pdf_conversion(file_id, dpi, db, render_mode, variants)
+            return result
+        except RETRYABLE_ERRORS as e:
+            span.record_exception(e)
+            if self.request.retries < self.max_retries:
+                # autoretry_for schedules the retry with exponential backoff; the job stays "processing"
+                logger.warning(f"Task for file {file_id} hit a transient error, retrying: {str(e)}")
+                raise
+            logger.error(f"Task failed for file {file_id} after {self.request.retries} retries: {str(e)}")
+            _mark_failed(db, file_id)
+            return f"Error: {str(e)}"
+        except Exception as e:
+            logger.error(f"Task failed for file {file_id}: {str(e)}")
+            span.record_exception(e)
+            # Ensure status is updated to failed on critical errors
+            _mark_failed(db, file_id)
+            return f"Error: {str(e)}"
+        finally:
+            db.close()
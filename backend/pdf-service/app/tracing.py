@@ -0,0 +1,95 @@
+import os
+from opentelemetry import trace, propagate
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.trace import SpanKind
+
+# "file" writes one JSON span per line to TRACE_FILE, "otlp" uses OTEL_EXPORTER_OTLP_ENDPOINT, "none" disables export
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "file")
+TRACE_FILE = os.getenv("TRACE_FILE", "/tmp/easyconvert-traces.jsonl")
+
+tracer = trace.get_tracer("easyconvert")
+
+def setup_tracing(service_name: str):
+    """
+    Installs the tracer provider and exporter for this process (once, at startup).
+    The batch exporter restarts its thread in forked children, so Celery prefork workers inherit it.
+    """
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+
+    if TRACE_EXPORTER == "file":
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        exporter = ConsoleSpanExporter(
+            out=open(TRACE_FILE, "a", buffering=1),
+            formatter=lambda span: span.to_json(indent=None) + "\n",
+        )
+    elif TRACE_EXPORTER == "otlp":
+        # Only needed when exporting to a collector
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        exporter = None
+
+    if exporter is not None:
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+
+    trace.set_tracer_provider(provider)
+
+class _CeleryRequestGetter:
+    """
+    Reads propagation headers from a Celery task request (custom headers become request attributes).
+    """
+
+    def get(self, carrier, key):
+        value = carrier.get(key)
+        return [value] if value is not None else None
+
+    def keys(self, carrier):
+        return []
+
+def inject_headers(headers: dict) -> dict:
+    """
+    Adds the current trace context (traceparent/tracestate) to an outgoing header dict.
+    """
+    propagate.inject(headers)
+    return headers
+
+def extract_task_context(request):
+    return propagate.extract(request, getter=_CeleryRequestGetter())
+
+class TracingMiddleware:
+    """
+    Pure ASGI middleware that continues an incoming trace (or starts one) with a server span per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or trace.get_current_span().get_span_context().is_valid:
+            # Newer FastAPI versions open the server span themselves when a tracer provider is set
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        context = propagate.extract(headers)
+        method = scope["method"]
+        with tracer.start_as_current_span(f"{method} {scope['path']}", context=context, kind=SpanKind.SERVER) as span:
+            span.set_attribute("http.method", method)
+            span.set_attribute("http.target", scope["path"])
+
+            async def traced_send(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                route = scope.get("metrics_route")
+                if route is None and scope.get("route") is not None:
+                    route = scope["route"].path
+                if route is not None:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
@@ -0,0 +1,65 @@
+import asyncio
+import os
+import time
+
+# How often the monitor wakes up, and the lag above which a tick counts as "blocked"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.05"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+
+class LoopLagMonitor:
+    """
+    Measures event-loop blocking by scheduling a periodic sleep and recording
+    how late each wake-up is. Any lag is time the loop spent running
+    something that did not yield (e.g. a synchronous DB commit).
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.ticks = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_ticks = 0
+        self.blocked_seconds = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.ticks += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.blocked_ticks += 1
+                self.blocked_seconds += lag
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.ticks = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_ticks = 0
+        self.blocked_seconds = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "interval_seconds": self.interval,
+            "ticks": self.ticks,
+            "avg_lag_seconds": self.total_lag / self.ticks if self.ticks else 0.0,
+            "max_lag_seconds": self.max_lag,
+            "total_lag_seconds": self.total_lag,
+            "blocked_ticks": self.blocked_ticks,
+            "blocked_seconds": self.blocked_seconds,
+        }
+
+loop_monitor = LoopLagMonitor()
@@ -0,0 +1,100 @@
+from __future__ import annotations
+import io
+import math
+import os
+import struct
+import zlib
+from ..backends import LazyBackend
+from ..metrics import time_stage
+
+fitz = LazyBackend("fitz")
+
+# Accepted range for the dpi parameter
+MIN_DPI = int(os.getenv("MIN_DPI", "36"))
+MAX_DPI = int(os.getenv("MAX_DPI", "1200"))
+# Resolutions one conversion job may render
+MAX_VARIANTS = int(os.getenv("MAX_VARIANTS", "5"))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+# Largest page (in pixels) rendered in one piece; higher dpi requests are capped to fit
+MAX_PAGE_PIXELS = int(os.getenv("MAX_PAGE_PIXELS", "40000000"))
+# Hard ceiling for tiled rendering, which keeps memory bounded but still produces the full image
+MAX_TILED_PAGE_PIXELS = int(os.getenv("MAX_TILED_PAGE_PIXELS", "400000000"))
+# Pixels rendered per tile (a full-width band of rows) in tiled mode
+TILE_PIXELS = int(os.getenv("TILE_PIXELS", "4000000"))
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+
+def page_pixels(rect: fitz.Rect, dpi: int) -> int:
+    """
+    Returns the number of pixels a page of the given size renders to at dpi.
+    """
+    return int((rect * fitz.Matrix(dpi / 72, dpi / 72)).irect.get_area())
+
+def capped_dpi(rect: fitz.Rect, dpi: int, max_pixels: int = MAX_PAGE_PIXELS) -> int:
+    """
+    Returns the highest dpi (up to the requested one) whose rendering stays within max_pixels.
+    """
+    if page_pixels(rect, dpi) <= max_pixels:
+        return dpi
+    area = rect.width * rect.height
+    dpi = max(1, int(72 * math.sqrt(max_pixels / area)))
+    # Rounding of the pixel rectangle can overshoot by a row or column
+    while dpi > 1 and page_pixels(rect, dpi) > max_pixels:
+        dpi -= 1
+    return dpi
+
+def plan_page(rect: fitz.Rect, dpi: int, render_mode: str) -> tuple[int, bool]:
+    """
+    Returns (effective dpi, tiled) for a page.
+    "capped" lowers the dpi to fit MAX_PAGE_PIXELS; "tiled" keeps it (up to MAX_TILED_PAGE_PIXELS)
+    and renders pages above MAX_PAGE_PIXELS in tiles.
+    """
+    if render_mode == "tiled":
+        dpi = capped_dpi(rect, dpi, MAX_TILED_PAGE_PIXELS)
+        return dpi, page_pixels(rect, dpi) > MAX_PAGE_PIXELS
+    return capped_dpi(rect, dpi), False
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def render_tiled_png(page: fitz.Page, dpi: int, display_list: fitz.DisplayList = None) -> bytes:
+    """
+    Renders a page in full-width bands from one display list and streams the rows into a PNG,
+    so only one band of raw pixels is held in memory at a time.
+    """
+    if display_list is None:
+        with time_stage("pdf_conversion", "decode"):
+            display_list = page.get_displaylist()
+    zoom = dpi / 72
+    matrix = fitz.Matrix(zoom, zoom)
+    full = (page.rect * matrix).irect
+    width, height = full.width, full.height
+    band_rows = max(1, TILE_PIXELS // width)
+
+    output = io.BytesIO()
+    output.write(b"\x89PNG\r\n\x1a\n")
+    # 8-bit RGB, no interlacing
+    output.write(_png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    compressor = zlib.compressobj(PNG_COMPRESS_LEVEL)
+
+    for top in range(full.y0, full.y1, band_rows):
+        bottom = min(top + band_rows, full.y1)
+        clip = fitz.Rect(page.rect.x0, top / zoom, page.rect.x1, bottom / zoom)
+        with time_stage("pdf_conversion", "render"):
+            pix = display_list.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+        with time_stage("pdf_conversion", "encode"):
+            samples = pix.samples_mv
+            row_bytes = width * 3
+            for y in range(top, bottom):
+                # Clamp in case the band came out a row short or long
+                src = min(max(y - pix.y, 0), pix.height - 1) * pix.stride
+                row = samples[src:src + min(row_bytes, pix.stride)]
+                data = compressor.compress(b"\x00") + compressor.compress(row)
+                if len(row) < row_bytes:
+                    data += compressor.compress(bytes(row_bytes - len(row)))
+                if data:
+                    output.write(_png_chunk(b"IDAT", data))
+        pix = None
+
+    output.write(_png_chunk(b"IDAT", compressor.flush()))
+    output.write(_png_chunk(b"IEND", b""))
+    return output.getvalue()
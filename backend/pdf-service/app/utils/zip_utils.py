@@ -1,11 +1,16 @@
 import io
 import zipfile
 
-def create_zip_from_images(images):
+def create_zip_from_images(images, by_variant: bool = False):
+    """
+    Zips ProcessedImages rows as page_<n>.<format>, in one folder per variant when by_variant is set.
+    """
     zip_buffer = io.BytesIO()
     with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
         for img in images:
-            zip_file.writestr(f"page_{img.page_number}.png", img.image_data)
+            extension = "jpg" if img.image_format == "jpeg" else img.image_format
+            filename = f"page_{img.page_number}.{extension}"
+            zip_file.writestr(f"{img.variant}/{filename}" if by_variant else filename, img.image_data)
     zip_buffer.seek(0)
     return zip_buffer
 
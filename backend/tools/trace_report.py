@@ -0,0 +1,82 @@
+"""
+Prints the span tree of a trace from the JSON-lines span file written by the services
+(TRACE_EXPORTER=file). Without a trace id it lists the slowest traces.
+
+    python tools/trace_report.py /tmp/easyconvert-traces.jsonl
+    python tools/trace_report.py /tmp/easyconvert-traces.jsonl --trace 0af7651916cd43dd8448eb211c80319c
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import datetime
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+def load_spans(paths: list[str]) -> dict[str, list[dict]]:
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                span = json.loads(line)
+                span["_start"] = _timestamp(span["start_time"])
+                span["_end"] = _timestamp(span["end_time"])
+                span["_service"] = span.get("resource", {}).get("attributes", {}).get("service.name", "?")
+                traces[span["context"]["trace_id"].removeprefix("0x")].append(span)
+    return traces
+
+def print_trace(spans: list[dict], min_ms: float):
+    children = defaultdict(list)
+    span_ids = {span["context"]["span_id"] for span in spans}
+    roots = []
+    for span in spans:
+        parent = span.get("parent_id")
+        if parent in span_ids:
+            children[parent].append(span)
+        else:
+            roots.append(span)
+
+    trace_start = min(span["_start"] for span in spans)
+
+    def walk(span, depth):
+        duration_ms = (span["_end"] - span["_start"]) * 1000
+        if duration_ms < min_ms and depth > 0:
+            return
+        offset_ms = (span["_start"] - trace_start) * 1000
+        print(f"{offset_ms:9.1f}ms {duration_ms:9.1f}ms  {'  ' * depth}{span['name']} [{span['_service']}]")
+        for child in sorted(children[span["context"]["span_id"]], key=lambda s: s["_start"]):
+            walk(child, depth + 1)
+
+    print(f"{'offset':>11} {'duration':>11}  span")
+    for root in sorted(roots, key=lambda s: s["_start"]):
+        walk(root, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Break a trace down span by span")
+    parser.add_argument("files", nargs="+", help="Span files (JSON lines)")
+    parser.add_argument("--trace", help="Trace id to print (hex, without 0x)")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest traces to list")
+    parser.add_argument("--min-ms", type=float, default=0.0, help="Hide child spans shorter than this")
+    args = parser.parse_args()
+
+    traces = load_spans(args.files)
+    if args.trace:
+        spans = traces.get(args.trace.removeprefix("0x"))
+        if not spans:
+            parser.error(f"Trace {args.trace} not found")
+        print_trace(spans, args.min_ms)
+        return
+
+    durations = []
+    for trace_id, spans in traces.items():
+        duration = max(s["_end"] for s in spans) - min(s["_start"] for s in spans)
+        root = min(spans, key=lambda s: s["_start"])
+        durations.append((duration, trace_id, root["name"], len(spans)))
+    for duration, trace_id, name, count in sorted(durations, reverse=True)[:args.top]:
+        print(f"{trace_id}  {duration * 1000:9.1f}ms  {count:5d} spans  {name}")
+
+if __name__ == "__main__":
+    main()